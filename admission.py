@@ -0,0 +1,252 @@
+# admission.py - Admission control for classroom bursts
+# Caps how many /ask requests (and /ask_batch retrieval + LLM calls, at upload
+# priority) run at once. The rest wait in a bounded queue where plain text
+# questions go before file uploads and worksheets, and clients take turns.
+# A request whose predicted queue wait would miss the SLO is rejected right
+# away, so the caller gets a fast 429 + Retry-After instead of a slow answer.
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import sys
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+# -------- CONFIG --------
+MAX_ACTIVE_REQUESTS = 4      # requests allowed to use the models/OCR/Groq at once
+MAX_QUEUE_LENGTH = 64        # waiting requests beyond this are rejected
+QUEUE_SLO_SECONDS = 8.0      # longest acceptable wait before processing starts
+
+# Priority classes (lower is served first)
+TEXT_QUESTION = 0
+FILE_UPLOAD = 1
+PRIORITY_NAMES = {TEXT_QUESTION: "text", FILE_UPLOAD: "upload"}
+
+# Initial service-time estimates (seconds), refined from observed requests
+INITIAL_SERVICE_SECONDS = {TEXT_QUESTION: 2.0, FILE_UPLOAD: 8.0}
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot start within the queue-time SLO"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded priority queue with per-client round-robin in front of a fixed number of slots
+
+    Queue order is (priority, client round, arrival): a client's n-th waiting
+    request gets round n, so one student sending five questions cannot push
+    everyone else's first question back. Must be used from one event loop.
+    """
+
+    def __init__(
+        self,
+        max_active=MAX_ACTIVE_REQUESTS,
+        max_queue=MAX_QUEUE_LENGTH,
+        queue_slo=QUEUE_SLO_SECONDS,
+    ):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_slo = queue_slo
+        self.service_seconds = dict(INITIAL_SERVICE_SECONDS)
+        self.active = 0
+        self._active_by_priority = Counter()
+        self._heap = []
+        self._waiting = 0
+        self._client_rounds = Counter()
+        self._order = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_waits = deque(maxlen=1000)
+
+    # -------- PREDICTION --------
+    def busy(self):
+        """Every slot is taken or requests are waiting for one"""
+        return self.active >= self.max_active or self._waiting > 0
+
+    def predicted_wait(self, priority):
+        """Seconds a new request of this priority would wait for a slot"""
+        if self.active < self.max_active and self._waiting == 0:
+            return 0.0
+        ahead = sum(
+            self.service_seconds[entry[0]]
+            for entry in self._heap
+            if entry[0] <= priority and not entry[4].done()
+        )
+        # Requests in progress are, on average, half done
+        busy = 0.0
+        if self.active >= self.max_active:
+            busy = sum(self.service_seconds[p] * n for p, n in self._active_by_priority.items()) / 2
+        return (ahead + busy) / self.max_active
+
+    # -------- QUEUE --------
+    async def acquire(self, client_id, priority):
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(math.ceil(self.queue_slo), "queue full")
+
+        wait = self.predicted_wait(priority)
+        if wait > self.queue_slo:
+            self.rejected += 1
+            raise Overloaded(max(1, math.ceil(wait - self.queue_slo)), f"predicted wait {wait:.1f}s")
+
+        if self.active < self.max_active and self._waiting == 0:
+            self.active += 1
+            self._active_by_priority[priority] += 1
+            self.admitted += 1
+            self.queue_waits.append(0.0)
+            return
+
+        round_ = self._client_rounds[client_id]
+        self._client_rounds[client_id] += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, round_, next(self._order), client_id, future))
+        self._waiting += 1
+        enqueued = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Client went away: give up the place, or the slot if it was just granted
+            if future.done() and not future.cancelled():
+                self.release(priority, None)
+            else:
+                self._waiting -= 1
+                self._forget_round(client_id)
+            raise
+        self.admitted += 1
+        self.queue_waits.append(time.perf_counter() - enqueued)
+
+    def _forget_round(self, client_id):
+        self._client_rounds[client_id] -= 1
+        if self._client_rounds[client_id] <= 0:
+            del self._client_rounds[client_id]
+
+    def release(self, priority, service_seconds):
+        if service_seconds is not None:
+            self.service_seconds[priority] += SERVICE_TIME_SMOOTHING * (
+                service_seconds - self.service_seconds[priority]
+            )
+        self.active -= 1
+        self._active_by_priority[priority] -= 1
+        while self._heap and self.active < self.max_active:
+            next_priority, _, _, client_id, future = heapq.heappop(self._heap)
+            if future.done():
+                continue   # cancelled while waiting
+            self._waiting -= 1
+            self._forget_round(client_id)
+            self.active += 1
+            self._active_by_priority[next_priority] += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, client_id, priority):
+        """Hold one processing slot for the duration of the block (may raise Overloaded)"""
+        await self.acquire(client_id, priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(priority, time.perf_counter() - start)
+
+    def stats(self):
+        waits = sorted(self.queue_waits)
+        return {
+            "active": self.active,
+            "waiting": self._waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "service_seconds": {PRIORITY_NAMES[p]: s for p, s in self.service_seconds.items()},
+        }
+
+
+# -------- BURST SIMULATION --------
+class SharedBackend:
+    """Models the shared OCR/embedding/Groq capacity of one server
+
+    Up to `capacity` requests progress at full speed; beyond that every
+    request slows down proportionally, plus a contention penalty for memory
+    pressure and context switching.
+    """
+
+    TICK = 0.01
+    CONTENTION_PENALTY = 0.03
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.running = 0
+
+    async def run(self, work_seconds):
+        self.running += 1
+        try:
+            remaining = work_seconds
+            while remaining > 0:
+                await asyncio.sleep(self.TICK)
+                overload = max(0, self.running - self.capacity)
+                rate = min(1.0, self.capacity / self.running) / (1 + self.CONTENTION_PENALTY * overload)
+                remaining -= self.TICK * rate
+        finally:
+            self.running -= 1
+
+
+async def simulate_burst(use_admission, students=40, upload_share=0.25, time_scale=0.1, seed=0):
+    """Whole class asks within ~1 second; returns {kind: [end-to-end latencies]} and 429 counts
+
+    Rejected students retry after Retry-After (like the frontend does), so
+    latencies with admission control include the time spent backing off.
+    """
+    rng = random.Random(seed)
+    backend = SharedBackend(capacity=MAX_ACTIVE_REQUESTS)
+    controller = AdmissionController(queue_slo=QUEUE_SLO_SECONDS * time_scale)
+    controller.service_seconds = {p: s * time_scale for p, s in INITIAL_SERVICE_SECONDS.items()}
+    latencies = {"text": [], "upload": []}
+    rejected = Counter()
+
+    async def student(i):
+        await asyncio.sleep(rng.uniform(0, 1.0) * time_scale)
+        priority = FILE_UPLOAD if rng.random() < upload_share else TEXT_QUESTION
+        work = INITIAL_SERVICE_SECONDS[priority] * rng.uniform(0.7, 1.3) * time_scale
+        kind = PRIORITY_NAMES[priority]
+        start = time.perf_counter()
+        if not use_admission:
+            await backend.run(work)
+        while use_admission:
+            try:
+                async with controller.slot(f"student{i}", priority):
+                    await backend.run(work)
+                break
+            except Overloaded as e:
+                rejected[kind] += 1
+                await asyncio.sleep(e.retry_after * time_scale)
+        latencies[kind].append((time.perf_counter() - start) / time_scale)
+
+    await asyncio.gather(*(student(i) for i in range(students)))
+    return latencies, rejected
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Synthetic burst test: python admission.py [students]
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    print(f"📊 Burst of {students} students (25% with uploads), {MAX_ACTIVE_REQUESTS} slots, "
+          f"queue SLO {QUEUE_SLO_SECONDS:.0f}s (simulated seconds)")
+    for use_admission in (False, True):
+        latencies, rejected = asyncio.run(simulate_burst(use_admission, students))
+        label = "with admission control" if use_admission else "without admission control"
+        print(f"\n   {label}")
+        for kind, values in latencies.items():
+            print(f"     {kind:6s}: served {len(values):3d} | 429s {rejected[kind]:3d} | "
+                  f"p50 {percentile(values, 0.5):5.1f}s | p95 {percentile(values, 0.95):5.1f}s | "
+                  f"p99 {percentile(values, 0.99):5.1f}s")
@@ -1,5 +1,7 @@
-from fastapi import FastAPI, UploadFile, Form
+from fastapi import FastAPI, UploadFile, Form, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from groq import Groq
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
@@ -8,11 +10,29 @@ import chromadb
 import fitz 
 import os
 import re
+import json
+import asyncio
+import threading
 from PIL import Image
-import pytesseract
+import numpy as np
 import io
 import docx
 from pathlib import Path
+from faq_index import load_faq_collection, lookup_faq
+from session_store import SessionStore, is_follow_up, rewrite_follow_up
+import tts_engine
+from ocr_service import ocr_image
+import compact_store
+import index_snapshot
+import metadata_index
+from compact_store import load_compact_index
+from index_snapshot import load_snapshot_index
+from retrieval_cache import RetrievalCache
+from retrieval_controller import RetrievalController
+from admission import FILE_UPLOAD, TEXT_QUESTION, AdmissionController, Overloaded
+from db_versions import release_version, resolve_db_path
+from embedding_models import EMBEDDING_MODELS, check_model
+from metadata_index import load_metadata_index
 
 
 app = FastAPI()
@@ -24,6 +44,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Range", "Accept-Ranges", "Retry-After"],
 )
 
 # Groq API Key
@@ -31,14 +52,53 @@ API_KEY = "YOUR_API_KEY"
 client = Groq(api_key=API_KEY)
 
 # Embeddings for English
-embeddings_en = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings_en = HuggingFaceEmbeddings(model_name=EMBEDDING_MODELS["english"])
 
 # Embeddings for Gujarati
-embeddings_gu = SentenceTransformer("intfloat/multilingual-e5-base")
+embeddings_gu = SentenceTransformer(EMBEDDING_MODELS["gujarati"])
 
 # Base DB path
 BASE_PATH = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\vector_db"
 
+# Serve from the compressed vector store when a DB has been converted
+# with `python compact_store.py convert ...`
+USE_COMPACT_STORE = True
+
+# Gujarati chunks farther than this from the query are not used as context
+GUJARATI_MAX_DISTANCE = 1.5
+
+# Upper bound on simultaneous Groq calls from one /ask_batch request
+MAX_CONCURRENT_LLM_CALLS = 4
+
+# A worksheet question the admission queue turns away is retried this often
+BATCH_ADMISSION_RETRIES = 3
+
+# Upper bound on /prefetch warm-ups running at once (the rest are skipped)
+MAX_CONCURRENT_PREFETCHES = 2
+
+# Seconds a superseded DB version stays open for requests already using it
+# before its Chroma system and cached indexes are released
+SUPERSEDED_RELEASE_DELAY = 60
+
+# Memoised textbook retrieval, invalidated by DB version stamps
+retrieval_cache = RetrievalCache()
+
+# Per-DB calibrated retrieval depth and low-confidence early exit
+retrieval_controller = RetrievalController()
+
+# Bounded, prioritised queue in front of /ask for classroom bursts (see admission.py)
+admission = AdmissionController()
+
+# Conversation sessions (only used when the client sends a session_id field)
+sessions = SessionStore()
+
+# Subject DB warm-ups requested while a question is being spoken (see /prefetch)
+prefetch_slots = asyncio.Semaphore(MAX_CONCURRENT_PREFETCHES)
+
+# Version directory each subject DB was last served from
+served_versions = {}
+served_versions_lock = threading.Lock()
+
 def is_gujarati_text_valid(text):
     """Check if text contains meaningful Gujarati characters"""
     gujarati_chars = re.findall(r'[\u0A80-\u0AFF]', text)
@@ -64,6 +124,12 @@ def detect_language(subject: str):
     subject_lower = subject.lower()
     return "gujarati" if "gujarati" in subject_lower else "english"
 
+def render_page_gray(page, zoom=2):
+    """Render a PDF page as a uint8 grayscale array"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    samples = np.frombuffer(pix.samples, dtype=np.uint8)
+    return samples.reshape(pix.height, pix.stride)[:, :pix.width]
+
 def extract_text_from_pdf(pdf_bytes):
     """Extract text from PDF, use OCR for images if no text is available"""
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
@@ -76,13 +142,13 @@ def extract_text_from_pdf(pdf_bytes):
         # If no text found or very little text, use OCR
         if len(text) < 50:  # Threshold for considering it as image-based
             print(f"Page {page_num + 1}: Using OCR (little/no text found)")
-            # Convert page to image
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better quality
-            img_bytes = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_bytes))
+            # Render straight to grayscale and OCR the pixel buffer (no PNG round-trip);
+            # Tesseract binarises it itself, as it did the colour render
+            gray = render_page_gray(page, zoom=2)  # 2x zoom for better quality
+            img = Image.fromarray(gray)
             
             # Perform OCR with Gujarati + English support
-            ocr_text = pytesseract.image_to_string(img, lang='guj+eng')
+            ocr_text = ocr_image(img, lang='guj+eng')
             full_text += ocr_text + "\n"
         else:
             print(f"Page {page_num + 1}: Using direct text extraction")
@@ -94,7 +160,7 @@ def extract_text_from_image(image_bytes):
     """Extract text from image using OCR"""
     img = Image.open(io.BytesIO(image_bytes))
     # Use both Gujarati and English for OCR
-    text = pytesseract.image_to_string(img, lang='guj+eng')
+    text = ocr_image(img, lang='guj+eng')
     return text
 
 def extract_text_from_docx(file_bytes):
@@ -118,8 +184,8 @@ def extract_text_from_txt(file_bytes):
     # If all encodings fail, use utf-8 with errors ignored
     return file_bytes.decode('utf-8', errors='ignore')
 
-def load_subject_db(grade: str, subject: str):
-    """Load the Chroma database for the given grade & subject."""
+def get_db_path(grade: str, subject: str):
+    """Return (db_path, collection_name, language) for the given grade & subject."""
     subject_lower = subject.lower()
     language = detect_language(subject)
     
@@ -128,13 +194,11 @@ def load_subject_db(grade: str, subject: str):
         # For Gujarati subjects, use the specific gujarati DB naming
         if "evs" in subject_lower or "environmental" in subject_lower:
             db_path = os.path.join(BASE_PATH, f"grade{grade}_gujarati_evs_db")
-            collection_name = "gujarati_textbook_db"
         elif "maths" in subject_lower:
             db_path = os.path.join(BASE_PATH, f"grade{grade}_gujarati_maths_db")
-            collection_name = "gujarati_textbook_db"
         else:
             db_path = os.path.join(BASE_PATH, f"grade{grade}_gujarati_gujarati_db")
-            collection_name = "gujarati_textbook_db"
+        collection_name = "gujarati_textbook_db"
     else:
         # English subjects use the original naming
         if "evs" in subject_lower or "environmental" in subject_lower:
@@ -146,38 +210,160 @@ def load_subject_db(grade: str, subject: str):
         db_path = os.path.join(BASE_PATH, f"grade{grade}_{subject_name}_db")
         collection_name = "textbook_db"
     
+    return db_path, collection_name, language
+
+def load_subject_db(grade: str, subject: str):
+    """Load the Chroma database for the given grade & subject."""
+    db_path, collection_name, language = get_db_path(grade, subject)
+    
     if not os.path.exists(db_path):
         return None, language
     
+    physical_path = resolve_db_path(db_path)
+    note_served_version(db_path, physical_path)
+    db = open_subject_db(physical_path, collection_name, language)
+    
+    # Query vectors from another model than the DB was built with give meaningless distances
+    ok, stored = check_model(query_collection(db), collection_name, EMBEDDING_MODELS[language])
+    if not ok:
+        print(f"Embedding model mismatch for {db_path}: built with {stored}, querying with {EMBEDDING_MODELS[language]}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"This subject's database was built with {stored}; re-embed it with "
+                   f"'python embedding_models.py reembed' before serving it.",
+        )
+    return db, language
+
+def note_served_version(db_path, physical_path):
+    """Schedule the release of the version a subject DB was served from before a publish"""
+    with served_versions_lock:
+        previous = served_versions.get(db_path)
+        served_versions[db_path] = physical_path
+    if previous and previous != physical_path:
+        timer = threading.Timer(SUPERSEDED_RELEASE_DELAY, release_superseded_version, args=(previous,))
+        timer.daemon = True
+        timer.start()
+
+def release_superseded_version(physical_path):
+    """Close a superseded version so the next build's garbage collection can delete it"""
+    release_version(physical_path)
+    compact_store._loaded.pop(compact_store.compact_dir(physical_path), None)
+    index_snapshot._loaded.pop(os.path.join(physical_path, index_snapshot.SNAPSHOT_FILE), None)
+    metadata_index._loaded.pop(os.path.join(physical_path, metadata_index.METADATA_INDEX_FILE), None)
+    print(f"Released superseded DB version {physical_path}")
+
+def open_subject_db(db_path, collection_name, language):
+    """Open the published version of a subject DB in the fastest available form"""
+    if USE_COMPACT_STORE:
+        compact_index = load_compact_index(db_path)
+        if compact_index is not None:
+            return compact_index
+    
+    # Versions imported from a portable snapshot are served memory-mapped
+    snapshot_index = load_snapshot_index(db_path)
+    if snapshot_index is not None:
+        return snapshot_index
+    
     if language == "gujarati":
         # Use ChromaDB client directly for Gujarati
         chroma_client = chromadb.PersistentClient(path=db_path)
-        collection = chroma_client.get_or_create_collection(name=collection_name)
-        return collection, language
+        return chroma_client.get_or_create_collection(name=collection_name)
     else:
         # Use LangChain wrapper for English
         return Chroma(
             persist_directory=db_path,
             collection_name=collection_name,
             embedding_function=embeddings_en,
-        ), language
+        )
 
-def retrieve_gujarati_chunks(collection, query, n_results=5):
-    """Retrieve relevant chunks for Gujarati text"""
-    query_embedding = embeddings_gu.encode([query]).tolist()[0]
-    results = collection.query(query_embeddings=[query_embedding], n_results=n_results)
-    documents = results["documents"][0]
-    distances = results["distances"][0]
-    
-    # Filter and clean documents
+def embed_query(query, language):
+    """Embed a query with the model matching the subject language"""
+    if language == "gujarati":
+        return embeddings_gu.encode([query]).tolist()[0]
+    return embeddings_en.embed_query(query)
+
+def embed_queries(queries, language):
+    """Embed many queries in a single batch"""
+    if language == "gujarati":
+        return embeddings_gu.encode(queries).tolist()
+    return embeddings_en.embed_documents(queries)
+
+def query_collection(db):
+    """Chroma-style collection behind a subject DB, for multi-query lookups"""
+    if isinstance(db, Chroma):
+        return db._collection
+    return db
+
+def subject_calibration(db_path, db, language):
+    """Retrieval calibration of a subject DB, probed with its own query embeddings"""
+    return retrieval_controller.calibration(
+        db_path, query_collection(db), language, lambda texts: embed_queries(texts, language)
+    )
+
+def filter_gujarati_chunks(documents, distances):
+    """Clean OCR text and keep readable, close-enough Gujarati chunks"""
     valid_docs = []
     for doc, dist in zip(documents, distances):
         cleaned = clean_ocr_text(doc)
-        if is_gujarati_text_valid(cleaned) and dist < 1.5:
+        if is_gujarati_text_valid(cleaned) and dist < GUJARATI_MAX_DISTANCE:
             valid_docs.append(cleaned)
     
     return valid_docs
 
+def retrieve_gujarati_chunks(collection, query, n_results=5, query_embedding=None):
+    """Retrieve relevant chunks for Gujarati text"""
+    if query_embedding is None:
+        query_embedding = embed_query(query, "gujarati")
+    results = collection.query(query_embeddings=[query_embedding], n_results=n_results)
+    return filter_gujarati_chunks(results["documents"][0], results["distances"][0])
+
+def search_subject_db(db, query_embedding, n_results, where=None):
+    """Raw (ids, documents, distances) of the nearest textbook chunks, optionally pre-filtered"""
+    results = query_collection(db).query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        where=where,
+        include=["documents", "distances"],
+    )
+    return results["ids"][0], results["documents"][0], results["distances"][0]
+
+def load_subject_metadata(grade: str, subject: str, subject_db=None):
+    """Chapter/page metadata index of the published version of a subject DB"""
+    db_path, collection_name, _ = get_db_path(grade, subject)
+    physical_path = resolve_db_path(db_path)
+    metadata = load_metadata_index(physical_path)
+    if metadata is None:
+        # Versions published before metadata indexes existed: build it once from the DB
+        if subject_db is None:
+            subject_db, _ = load_subject_db(grade, subject)
+        metadata = load_metadata_index(physical_path, query_collection(subject_db), collection_name)
+    return metadata
+
+def expand_neighbours(db, metadata, ids, documents):
+    """Retrieved chunks surrounded by their neighbouring chunks, in reading order"""
+    expanded = metadata.neighbours(ids)
+    by_id = dict(zip(ids, documents))
+    missing = [chunk_id for chunk_id in expanded if chunk_id not in by_id]
+    if missing:
+        fetched = query_collection(db).get(ids=missing, include=["documents"])
+        by_id.update(zip(fetched["ids"], fetched["documents"]))
+    expanded = [chunk_id for chunk_id in expanded if chunk_id in by_id]
+    return expanded, [by_id[chunk_id] for chunk_id in expanded]
+
+def fetch_cached_chunks(db, cache_key):
+    """(ids, documents, distances) for a memoised query, or None on a cache miss"""
+    entry = retrieval_cache.get(cache_key)
+    if entry is None:
+        return None
+    ids = [chunk_id for chunk_id, _ in entry]
+    if not ids:
+        return [], [], []
+    fetched = query_collection(db).get(ids=ids, include=["documents"])
+    by_id = dict(zip(fetched["ids"], fetched["documents"]))
+    if any(chunk_id not in by_id for chunk_id in ids):
+        return None
+    return ids, [by_id[chunk_id] for chunk_id in ids], [dist for _, dist in entry]
+
 def process_uploaded_file(file: UploadFile, grade: str, subject: str):
     """Extract text from uploaded file and create temporary Chroma collection."""
     client_db = chromadb.EphemeralClient()
@@ -241,36 +427,223 @@ def process_uploaded_file(file: UploadFile, grade: str, subject: str):
     print(f"Added {len(chunks)} chunks to collection")
     return collection
 
+def no_context_answer(language):
+    """Localised guardrail reply when no textbook or upload context was found"""
+    if language == "gujarati":
+        return "માફ કરશો, મને તમારી પાઠ્યપુસ્તક અથવા અપલોડ કરેલી સામગ્રીમાં આ માહિતી મળી નથી. (Sorry, I couldn't find this information in your textbook or uploaded material.)"
+    return "Sorry, I couldn't find this in your textbook or uploaded material."
+
+def build_prompts(language, context, message):
+    """Return (system_prompt, user_prompt) for the subject language"""
+    if language == "gujarati":
+        system_prompt = """You are a kind Gujarati teacher for primary school students.
+
+CRITICAL RULES:
+1. You MUST answer ONLY using the provided textbook context.
+2. If the context is corrupted, unclear, or doesn't contain the answer, respond: "માફ કરશો, મને આ પ્રશ્નનો જવાબ પાઠ્યપુસ્તકમાં સ્પષ્ટ રીતે મળ્યો નથી."
+3. Always respond in Gujarati (ગુજરાતી ભાષામાં)
+4. Keep answers simple and detailed for primary students
+5. Do NOT use your general knowledge - ONLY the textbook context
+6. Provide complete, comprehensive answers but keep it as simple as possible, easy to understand for a child aged 5-8 years of age
+
+If the context below is unreadable or doesn't answer the question, you MUST say so."""
+
+        user_prompt = f"""પાઠ્યપુસ્તક અને અપલોડ કરેલી સામગ્રીમાંથી સંદર્ભ (Context from Textbook and Uploaded Material):
+{context}
+
+પ્રશ્ન (Question): {message}
+
+કૃપા કરીને વિગતવાર જવાબ આપો (Please provide a detailed answer):"""
+    else:
+        system_prompt = """You are a kind teacher for primary school students of India. Synthesize and rephrase the provided context to answer the user's question in a simple, clear, and comprehensive manner. Do not copy sentences verbatim. Provide complete, detailed answers but keep them simple and easy to understand for children of age 5-8 years. If the answer cannot be found in the provided context, politely say: 'Sorry, I couldn't find this in your textbook or uploaded material.'"""
+        
+        user_prompt = f"Context from textbook and uploaded material:\n{context}\n\nQuestion: {message}\n\nPlease provide a detailed answer:"
+
+    return system_prompt, user_prompt
+
+def generate_answer(system_prompt, user_prompt, history_messages=()):
+    """Call the Groq LLM and return the answer text"""
+    completion = client.chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            *history_messages,
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0,
+        top_p=0.9
+    )
+    return completion.choices[0].message.content
+
 @app.post("/ask")
 async def ask(
+    request: Request,
     message: str = Form(...),
     grade: str = Form(...),
     subject: str = Form(...),
     file: UploadFile | None = None,
+    session_id: str | None = Form(None),
+    new_session: bool = Form(False),
+    chapter: str | None = Form(None),
+    page: int | None = Form(None),
 ):
+    # An empty form field arrives as None, so a new conversation is requested
+    # explicitly. The session is resolved here, before admission, so even a
+    # student's first question queues under their own session id.
+    if new_session and not session_id:
+        session_id = ""
+    if session_id is not None:
+        session_id, _ = sessions.get_or_create(session_id)
+    # Text questions go before uploads; each student (session, else address) takes turns
+    priority = FILE_UPLOAD if file else TEXT_QUESTION
+    client_id = session_id or client_address(request)
+    try:
+        async with admission.slot(client_id, priority):
+            return await run_in_threadpool(answer_ask, message, grade, subject, file, session_id, chapter, page)
+    except Overloaded as e:
+        print(f"Rejected /ask from {client_id}: {e.reason}")
+        return overloaded_response(e)
+
+def client_address(request):
+    return request.client.host if request.client else "unknown"
+
+def overloaded_response(e):
+    """429 with Retry-After for a request the admission queue turned away"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many questions right now, please retry shortly", "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def answer_ask(message, grade, subject, file, session_id, chapter=None, page=None):
+    """Answer one /ask request (runs in a worker thread once admitted)"""
     print(f"\n=== New Query ===")
     print(f"Grade: {grade}, Subject: {subject}")
+    if chapter or page is not None:
+        print(f"Scope: chapter {chapter or 'any'}, page {page if page is not None else 'any'}")
     print(f"Message: {message}")
     print(f"File uploaded: {file.filename if file else 'None'}")
     
+    # 0. Session-aware mode: an empty or expired session_id starts a new session
+    session = None
+    if session_id is not None:
+        session_id, session = sessions.get_or_create(session_id)
+        session.bind(grade, subject)
+        print(f"Session: {session_id} ({len(session.history)} previous turns)")
+
+    # Follow-ups like "why?" are retrieved against the previous question
+    retrieval_query = message
+    follow_up = bool(session and session.history and is_follow_up(message))
+    if follow_up:
+        retrieval_query = rewrite_follow_up(message, session.topic)
+        print(f"Follow-up rewritten to: {retrieval_query}")
+
     # 1. Load subject DB
     subject_db, language = load_subject_db(grade, subject)
     context = ""
+    docs = []
+    turn_chunks = []    # retrieved for this turn; what the session remembers
+    query_embedding = None
+
+    def reply(answer):
+        if session is None:
+            return {"answer": answer}
+        session.add_turn(message, answer, turn_chunks, query_embedding, follow_up, scope=(chapter, page))
+        return {"answer": answer, "session_id": session_id}
 
     if subject_db:
         print(f"Language detected: {language}")
-        if language == "gujarati":
-            # Use Gujarati-specific retrieval
-            docs = retrieve_gujarati_chunks(subject_db, message, n_results=5)
-            if docs:
-                context += "\n\n".join(docs)
-                print(f"Retrieved {len(docs)} Gujarati chunks from textbook DB")
+        db_path, _, _ = get_db_path(grade, subject)
+        n_results = retrieval_controller.fetch_k(language)
+
+        # A chapter/page scope becomes a metadata pre-filter inside the index
+        where = None
+        if chapter or page is not None:
+            metadata = load_subject_metadata(grade, subject, subject_db)
+            try:
+                where = metadata.where(chapter, page)
+            except KeyError:
+                raise HTTPException(status_code=404, detail=f"Unknown chapter '{chapter}' (see /chapters)")
+            if page is not None and not metadata.supports_pages():
+                print("This DB has no page metadata (rebuild it to filter by page); filtering by chapter only")
+
+        # Frequent questions are answered from the precomputed FAQ index
+        # (see faq_index.py); uploads always go through full retrieval.
+        # FAQ entries are not tied to a chapter, so scoped questions skip it.
+        faq_applicable = not file and not follow_up and where is None
+        cache_key = retrieval_cache.make_key(
+            db_path, retrieval_query, n_results, extra=(faq_applicable, chapter, page)
+        )
+        cached = fetch_cached_chunks(subject_db, cache_key)
+        reused = None
+        if cached is not None:
+            # Cached under faq_applicable means the FAQ already missed for this DB version
+            ids, documents, distances = cached
+            print("Retrieval cache hit")
+        else:
+            query_embedding = embed_query(retrieval_query, language)
+            faq_collection = load_faq_collection(resolve_db_path(db_path), language) if faq_applicable else None
+            if faq_collection is not None:
+                faq_answer = lookup_faq(
+                    faq_collection,
+                    query_embedding,
+                    load_subject_metadata(grade, subject, subject_db).fingerprints,
+                )
+                if faq_answer:
+                    print("Answered from FAQ index")
+                    return reply(faq_answer)
+
+            reused = session.reusable_chunks(query_embedding, scope=(chapter, page)) if session else None
+            if not reused:
+                ids, documents, distances = search_subject_db(subject_db, query_embedding, n_results, where)
+                retrieval_cache.put(cache_key, ids, distances)
+
+        if not reused:
+            calibration = subject_calibration(db_path, subject_db, language)
+            keep, confident = retrieval_controller.select(calibration, distances, language)
+            documents, distances = documents[:keep], distances[:keep]
+
+            # The best hit is farther than almost any answerable question lands
+            # (see retrieval_controller.py): the LLM could only say it does not know
+            # (no results at all is not counted as a saved call: there was nothing to send)
+            if not confident and not file and not follow_up:
+                if distances:
+                    print(f"Low retrieval confidence (best distance {distances[0]}), skipping LLM")
+                    retrieval_controller.record_llm_call_saved()
+                else:
+                    print("No chunks retrieved, skipping LLM")
+                return reply(no_context_answer(language))
+
+        if reused:
+            docs = reused
+            print(f"Reusing {len(docs)} chunks from the previous turn")
+        elif where is not None:
+            # Scoped to a lesson: each hit comes with the chunks around it
+            if language == "gujarati":
+                close = [i for i, dist in enumerate(distances) if dist < GUJARATI_MAX_DISTANCE]
+                ids, documents = [ids[i] for i in close], [documents[i] for i in close]
+            ids, documents = expand_neighbours(subject_db, metadata, ids, documents)
+            if language == "gujarati":
+                docs = [doc for doc in map(clean_ocr_text, documents) if is_gujarati_text_valid(doc)]
+            else:
+                docs = documents
+            print(f"Retrieved {len(docs)} chunks (with neighbours) from textbook DB")
+        elif language == "gujarati":
+            # Use Gujarati-specific filtering
+            docs = filter_gujarati_chunks(documents, distances)
+            print(f"Retrieved {len(docs)} Gujarati chunks from textbook DB")
         else:
-            # Use English retrieval
-            docs = subject_db.similarity_search(message, k=3)
-            if docs:
-                context += "\n".join([d.page_content for d in docs])
-                print(f"Retrieved {len(docs)} English chunks from textbook DB")
+            docs = documents
+            print(f"Retrieved {len(docs)} English chunks from textbook DB")
+
+        # Follow-ups keep the previous turn's chunks alongside the new ones, up to
+        # the widest retrieval depth; only this turn's chunks are remembered
+        turn_chunks = docs
+        if follow_up and not reused:
+            docs = (docs + [c for c in session.last_chunks if c not in docs])[:max(n_results, len(docs))]
+
+        if docs:
+            context += ("\n\n" if language == "gujarati" else "\n").join(docs)
 
     # 2. If file uploaded, also search it
     upload_context = ""
@@ -284,8 +657,9 @@ async def ask(
             query_embedding = embeddings_gu.encode([message]).tolist()[0]
             results = upload_collection.query(query_embeddings=[query_embedding], n_results=3)
         else:
-            # Use English embeddings for query
-            results = upload_collection.query(query_texts=[message], n_results=3)
+            # Use English embeddings for query (the same model the chunks were embedded with)
+            upload_embedding = embeddings_en.embed_query(message)
+            results = upload_collection.query(query_embeddings=[upload_embedding], n_results=3)
         
         if results["documents"] and results["documents"][0]:
             upload_docs = results["documents"][0]
@@ -312,50 +686,283 @@ async def ask(
     # 3. Guardrail: no context found
     if not context.strip():
         print("No context found!")
-        if language == "gujarati":
-            return {
-                "answer": "માફ કરશો, મને તમારી પાઠ્યપુસ્તક અથવા અપલોડ કરેલી સામગ્રીમાં આ માહિતી મળી નથી. (Sorry, I couldn't find this information in your textbook or uploaded material.)"
-            }
-        else:
-            return {
-                "answer": "Sorry, I couldn't find this in your textbook or uploaded material."
-            }
+        return reply(no_context_answer(language))
 
     # 4. Query Groq with language-specific prompts
-    if language == "gujarati":
-        system_prompt = """You are a kind Gujarati teacher for primary school students.
+    system_prompt, user_prompt = build_prompts(language, context, message)
 
-CRITICAL RULES:
-1. You MUST answer ONLY using the provided textbook context.
-2. If the context is corrupted, unclear, or doesn't contain the answer, respond: "માફ કરશો, મને આ પ્રશ્નનો જવાબ પાઠ્યપુસ્તકમાં સ્પષ્ટ રીતે મળ્યો નથી."
-3. Always respond in Gujarati (ગુજરાતી ભાષામાં)
-4. Keep answers simple and detailed for primary students
-5. Do NOT use your general knowledge - ONLY the textbook context
-6. Provide complete, comprehensive answers but keep it as simple as possible, easy to understand for a child aged 5-8 years of age
+    # Earlier turns of the session give the LLM the conversation so far
+    history_messages = []
+    if session:
+        for turn in session.history:
+            history_messages.append({"role": "user", "content": turn["question"]})
+            history_messages.append({"role": "assistant", "content": turn["answer"]})
 
-If the context below is unreadable or doesn't answer the question, you MUST say so."""
+    answer = generate_answer(system_prompt, user_prompt, history_messages)
+    print(f"Generated answer length: {len(answer)} characters")
+    return reply(answer)
 
-        user_prompt = f"""પાઠ્યપુસ્તક અને અપલોડ કરેલી સામગ્રીમાંથી સંદર્ભ (Context from Textbook and Uploaded Material):
-{context}
+@app.post("/prefetch")
+async def prefetch(
+    grade: str = Form(...),
+    subject: str = Form(...),
+):
+    """Warm a subject DB while the question is still being spoken"""
+    # Best effort only: skipped while questions wait for (or fill) the slots,
+    # and at most MAX_CONCURRENT_PREFETCHES run at once
+    if admission.busy() or prefetch_slots.locked():
+        return {"warmed": False}
+    async with prefetch_slots:
+        return await run_in_threadpool(warm_subject, grade, subject)
 
-પ્રશ્ન (Question): {message}
+def warm_subject(grade, subject):
+    """Do what the first question after a (re)publish would otherwise wait for
 
-કૃપા કરીને વિગતવાર જવાબ આપો (Please provide a detailed answer):"""
+    Loads the subject DB, its retrieval calibration and metadata index and opens
+    its FAQ collection; all are cached per DB version, so repeats are cheap.
+    """
+    subject_db, language = load_subject_db(grade, subject)
+    if not subject_db:
+        return {"warmed": False}
+    db_path, _, _ = get_db_path(grade, subject)
+    subject_calibration(db_path, subject_db, language)
+    load_subject_metadata(grade, subject, subject_db)
+    load_faq_collection(resolve_db_path(db_path), language)
+    return {"warmed": True}
+
+def parse_questions(raw):
+    """Questions from a JSON list, or one per line with worksheet numbering stripped"""
+    raw = raw.strip()
+    if raw.startswith("["):
+        try:
+            items = json.loads(raw)
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list):
+            return [str(q).strip() for q in items if str(q).strip()]
+
+    questions = []
+    for line in raw.splitlines():
+        line = re.sub(r"^\s*(?:Q?\d+[.):]|[-*•])\s*", "", line).strip()
+        if line:
+            questions.append(line)
+    return questions
+
+def retrieve_batch(questions, grade, subject):
+    """(language, contexts, FAQ answers) for unique worksheet questions; blocking, run in the threadpool"""
+    # Load the subject DB once and run one multi-query lookup
+    subject_db, language = load_subject_db(grade, subject)
+    contexts = {}
+    ready_answers = {}
+
+    if subject_db and questions:
+        query_embeddings = embed_queries(questions, language)
+        results = query_collection(subject_db).query(
+            query_embeddings=query_embeddings,
+            n_results=retrieval_controller.fetch_k(language),
+        )
+        db_path, _, _ = get_db_path(grade, subject)
+        calibration = subject_calibration(db_path, subject_db, language)
+        faq_collection = load_faq_collection(resolve_db_path(db_path), language)
+        fingerprints = (
+            load_subject_metadata(grade, subject, subject_db).fingerprints if faq_collection is not None else {}
+        )
+        separator = "\n\n" if language == "gujarati" else "\n"
+
+        # Overlapping questions share cleaned chunks and identical contexts
+        chunk_texts = {}
+        shared_contexts = {}
+        for question, embedding, ids, documents, distances in zip(
+            questions, query_embeddings, results["ids"], results["documents"], results["distances"]
+        ):
+            faq_answer = lookup_faq(faq_collection, embedding, fingerprints)
+            if faq_answer:
+                ready_answers[question] = faq_answer
+                continue
+
+            keep, confident = retrieval_controller.select(calibration, distances, language)
+            if not confident:
+                if distances:
+                    retrieval_controller.record_llm_call_saved()
+                continue
+
+            kept = []
+            for chunk_id, doc, dist in zip(ids[:keep], documents[:keep], distances[:keep]):
+                if chunk_id not in chunk_texts:
+                    chunk_texts[chunk_id] = clean_ocr_text(doc) if language == "gujarati" else doc
+                if language == "gujarati" and not (is_gujarati_text_valid(chunk_texts[chunk_id]) and dist < GUJARATI_MAX_DISTANCE):
+                    continue
+                kept.append(chunk_id)
+
+            if kept:
+                key = tuple(kept)
+                if key not in shared_contexts:
+                    shared_contexts[key] = separator.join(chunk_texts[c] for c in kept)
+                contexts[question] = shared_contexts[key]
+
+        print(f"Retrieved {len(chunk_texts)} distinct chunks, {len(shared_contexts)} distinct contexts")
+
+    return language, contexts, ready_answers
+
+@app.post("/ask_batch")
+async def ask_batch(
+    request: Request,
+    questions: str = Form(...),
+    grade: str = Form(...),
+    subject: str = Form(...),
+):
+    """Answer a whole worksheet, streaming one JSON line per answer as it completes"""
+    question_list = parse_questions(questions)
+    # Repeated questions are answered once
+    unique_questions = list(dict.fromkeys(question_list))
+
+    print(f"\n=== New Batch ===")
+    print(f"Grade: {grade}, Subject: {subject}")
+    print(f"Questions: {len(question_list)} ({len(unique_questions)} unique)")
+
+    # Worksheets share the admission queue with /ask at upload priority, so a
+    # batch never holds back students' text questions
+    client_id = f"batch:{client_address(request)}"
+
+    # 1. Retrieval (embedding, multi-query lookup, calibration, FAQ) runs off the event loop
+    try:
+        async with admission.slot(client_id, FILE_UPLOAD):
+            language, contexts, ready_answers = await run_in_threadpool(
+                retrieve_batch, unique_questions, grade, subject
+            )
+    except Overloaded as e:
+        print(f"Rejected /ask_batch from {client_id}: {e.reason}")
+        return overloaded_response(e)
+
+    # 2. LLM calls run concurrently, capped by MAX_CONCURRENT_LLM_CALLS, each in an admission slot
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+    async def answer_question(question):
+        if question in ready_answers:
+            return question, ready_answers[question], None
+        if question not in contexts:
+            return question, no_context_answer(language), None
+        system_prompt, user_prompt = build_prompts(language, contexts[question], question)
+        try:
+            async with semaphore:
+                for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+                    try:
+                        async with admission.slot(client_id, FILE_UPLOAD):
+                            answer = await run_in_threadpool(generate_answer, system_prompt, user_prompt)
+                        return question, answer, None
+                    except Overloaded as e:
+                        if attempt == BATCH_ADMISSION_RETRIES:
+                            raise
+                        await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            print(f"Error answering '{question}': {e}")
+            return question, None, str(e)
+
+    async def result_stream():
+        tasks = [asyncio.create_task(answer_question(q)) for q in unique_questions]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                question, answer, error = await finished
+                for index, asked in enumerate(question_list):
+                    if asked != question:
+                        continue
+                    item = {"index": index, "question": question}
+                    if error:
+                        item["error"] = error
+                    else:
+                        item["answer"] = answer
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away mid-stream: questions still queued for the LLM are dropped
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                print(f"Batch stream closed early, cancelled {len(unfinished)} unanswered questions")
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+def audio_range_response(path, range_header):
+    """Serve a cached WAV file, honouring a single HTTP Range request"""
+    size = os.path.getsize(path)
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "public, max-age=31536000, immutable"}
+    if not range_header:
+        return FileResponse(path, media_type="audio/wav", headers=headers)
+
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
     else:
-        system_prompt = """You are a kind teacher for primary school students of India. Synthesize and rephrase the provided context to answer the user's question in a simple, clear, and comprehensive manner. Do not copy sentences verbatim. Provide complete, detailed answers but keep them simple and easy to understand for children of age 5-8 years. If the answer cannot be found in the provided context, politely say: 'Sorry, I couldn't find this in your textbook or uploaded material.'"""
-        
-        user_prompt = f"Context from textbook and uploaded material:\n{context}\n\nQuestion: {message}\n\nPlease provide a detailed answer:"
+        start, end = int(first), min(int(last) if last else size - 1, size - 1)
+    if start >= size or start > end:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
 
-    completion = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0 if language == "gujarati" else 0,
-        top_p=0.9
-    )
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(data, status_code=206, media_type="audio/wav", headers=headers)
 
-    answer = completion.choices[0].message.content
-    print(f"Generated answer length: {len(answer)} characters")
-    return {"answer": answer}
\ No newline at end of file
+@app.post("/tts")
+def tts(
+    text: str = Form(...),
+    language: str = Form("en-IN"),
+    gender: str = Form("female"),
+):
+    """Stream one JSON line per sentence as soon as its audio is ready"""
+    # Checked before streaming starts, so the frontend gets a 503 and uses browser voices
+    try:
+        tts_engine.voice_for(language, gender)
+    except tts_engine.VoiceUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Server voice unavailable: {e}")
+
+    def sentence_stream():
+        for item in tts_engine.synthesize_sentences(text, language, gender):
+            item["audio_url"] = f"/tts/audio/{item['audio_id']}"
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(sentence_stream(), media_type="application/x-ndjson")
+
+@app.get("/tts/audio/{audio_id}")
+def tts_audio(audio_id: str, request: Request):
+    """Serve cached sentence audio with range support"""
+    if not re.fullmatch(r"[0-9a-f]{64}", audio_id):
+        raise HTTPException(status_code=404, detail="Unknown audio")
+    path = tts_engine.audio_path(audio_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Unknown audio")
+    return audio_range_response(path, request.headers.get("range"))
+
+@app.get("/tts/stats")
+def tts_stats():
+    """Synthesis cache hit/miss counters"""
+    return tts_engine.stats_snapshot()
+
+@app.get("/chapters")
+def chapters(grade: str, subject: str):
+    """Chapters (with page ranges) of a subject DB, for the chapter/page filters of /ask"""
+    db_path, _, _ = get_db_path(grade, subject)
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail=f"No textbook DB for grade {grade} {subject}")
+    metadata = load_subject_metadata(grade, subject)
+    return {
+        "grade": grade,
+        "subject": subject,
+        "page_filter": metadata.supports_pages(),
+        "chapters": metadata.listing(),
+    }
+
+@app.get("/stats")
+def stats():
+    """Retrieval cache, retrieval controller and admission counters"""
+    return {
+        "retrieval_cache": retrieval_cache.stats(),
+        "retrieval_controller": retrieval_controller.stats(),
+        "admission": admission.stats(),
+    }
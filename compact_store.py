@@ -0,0 +1,423 @@
+# compact_store.py - Compressed (fp16 / int8) vector storage for the textbook DBs
+# Approximate distances are computed on the compressed codes, then a small
+# candidate set is re-scored exactly against the float32 vectors of the Chroma
+# collection the index was built from (read by ID, only for the candidates).
+# The index sits next to the Chroma data, which is kept for incremental builds,
+# the FAQ index and this re-scoring, so converting adds disk; `compare`
+# reports how much.
+import json
+import os
+import shutil
+import sys
+import time
+
+import chromadb
+import numpy as np
+
+from db_versions import is_snapshot_version, open_published_collection, resolve_db_path
+from embedding_models import stored_model
+from retrieval_cache import bump_db_version
+
+# -------- CONFIG --------
+COMPACT_DIR_NAME = "compact"      # created inside each subject DB directory
+RESCORE_FACTOR = 4                # candidates re-scored = n_results * RESCORE_FACTOR
+SCAN_BLOCK_ROWS = 8192            # rows decoded at a time during the approximate scan
+EXPORT_BATCH_SIZE = 5000
+
+
+def compact_dir(db_path):
+    return os.path.join(db_path, COMPACT_DIR_NAME)
+
+
+# -------- QUANTISATION --------
+def quantize(vectors, mode):
+    """Return (codes, params) for float32 vectors in 'fp16' or 'int8' mode"""
+    if mode == "fp16":
+        return vectors.astype(np.float16), {}
+    if mode == "int8":
+        # Per-dimension scalar quantisation onto [-127, 127]
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        scale = np.maximum(high - low, 1e-12) / 254.0
+        offset = (high + low) / 2.0
+        codes = np.clip(np.rint((vectors - offset) / scale), -127, 127).astype(np.int8)
+        return codes, {"scale": scale.astype(np.float32), "offset": offset.astype(np.float32)}
+    raise ValueError(f"Unknown compact mode: {mode}")
+
+
+def dequantize(codes, params):
+    if codes.dtype == np.int8:
+        return codes.astype(np.float32) * params["scale"] + params["offset"]
+    return codes.astype(np.float32)
+
+
+# -------- CONVERSION --------
+def export_collection(collection):
+    """Read all ids, vectors, documents and metadata out of a Chroma collection or SnapshotIndex"""
+    if hasattr(collection, "manifest") and hasattr(collection, "vectors"):
+        return (
+            list(collection.ids),
+            np.asarray(collection.vectors, dtype=np.float32),
+            list(collection.documents),
+            [m or {} for m in collection.metadatas],
+        )
+    ids, vectors, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=EXPORT_BATCH_SIZE,
+            offset=offset,
+        )
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        vectors.extend(batch["embeddings"])
+        documents.extend(batch["documents"])
+        metadatas.extend(m or {} for m in batch["metadatas"])
+        offset += len(batch["ids"])
+    return ids, np.asarray(vectors, dtype=np.float32), documents, metadatas
+
+
+def write_compact_index(directory, ids, vectors, documents, metadatas, mode, source=None, embedding_model=None,
+                        collection_name=None):
+    """Write codes and records for a CompactIndex
+
+    `collection_name` is the Chroma collection in the parent directory that
+    candidates are re-scored from; without it the index is approximate only.
+    """
+    os.makedirs(directory, exist_ok=True)
+    codes, params = quantize(vectors, mode)
+    np.save(os.path.join(directory, "codes.npy"), codes)
+    # Squared norms of the decoded vectors for the approximate L2 scan
+    np.save(os.path.join(directory, "code_norms.npy"), np.sum(dequantize(codes, params) ** 2, axis=1))
+    for name, value in params.items():
+        np.save(os.path.join(directory, f"{name}.npy"), value)
+
+    with open(os.path.join(directory, "records.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f, ensure_ascii=False)
+
+    manifest = {
+        "mode": mode,
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if len(ids) else 0,
+        "collection": collection_name,
+        "source": source,
+        "embedding_model": embedding_model,
+        "created_at": int(time.time()),
+    }
+    # Manifest last: its presence marks a complete index
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def convert_dir(db_dir, collection_name, mode="int8", source=None):
+    """Build the compact index inside one (version) directory of a Chroma DB"""
+    if is_snapshot_version(db_dir):
+        raise ValueError(f"{db_dir} was imported from a snapshot and is already served memory-mapped")
+    collection = chromadb.PersistentClient(path=db_dir).get_collection(name=collection_name)
+    ids, vectors, documents, metadatas = export_collection(collection)
+    return write_compact_index(
+        compact_dir(db_dir), ids, vectors, documents, metadatas, mode,
+        source=source,
+        embedding_model=stored_model(collection, collection_name),
+        collection_name=collection_name,
+    )
+
+
+def convert_db(db_path, collection_name, mode="int8"):
+    """Build the compact index for the published version of a Chroma subject DB"""
+    manifest = convert_dir(
+        resolve_db_path(db_path), collection_name, mode,
+        source={"db_path": db_path, "collection": collection_name},
+    )
+    bump_db_version(db_path)
+    return manifest
+
+
+def compact_mode(db_dir):
+    """Mode of the compact index in a (version) directory, or None if it has none"""
+    try:
+        with open(os.path.join(compact_dir(db_dir), "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)["mode"]
+    except OSError:
+        return None
+
+
+# -------- METADATA FILTERS --------
+WHERE_OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+MAX_CACHED_FILTERS = 256
+
+
+def matches_where(metadata, where):
+    """Evaluate a Chroma-style `where` filter against one chunk's metadata"""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = (metadata or {}).get(key)
+            if not all(WHERE_OPERATORS[op](value, operand) for op, operand in condition.items()):
+                return False
+    return True
+
+
+class FilterCache:
+    """Rows matching each `where` filter seen so far, so repeat filters skip the metadata scan"""
+
+    def __init__(self, metadatas):
+        self.metadatas = metadatas
+        self._rows = {}
+
+    def rows(self, where):
+        key = json.dumps(where, sort_keys=True)
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = np.array(
+                [row for row, meta in enumerate(self.metadatas) if matches_where(meta, where)],
+                dtype=np.int64,
+            )
+            if len(self._rows) >= MAX_CACHED_FILTERS:
+                self._rows.clear()
+            self._rows[key] = rows
+        return rows
+
+
+# -------- SEARCH --------
+class ChunkIndex:
+    """Chroma-style `count`, `get` and `query` over in-memory chunk records
+
+    Subclasses hold the vectors and implement search(query, n_results, rows=None).
+    """
+
+    def __init__(self, records):
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.filters = FilterCache(self.metadatas)
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, ids, include=None):
+        """Chroma-style lookup of chunks by ID"""
+        rows = [self.rows[chunk_id] for chunk_id in ids if chunk_id in self.rows]
+        return {
+            "ids": [self.ids[r] for r in rows],
+            "documents": [self.documents[r] for r in rows],
+            "metadatas": [self.metadatas[r] for r in rows],
+        }
+
+    def query(self, query_embeddings, n_results=5, include=None, where=None):
+        """Chroma-style query result for drop-in use by the retrieval functions"""
+        allowed = self.filters.rows(where) if where else None
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for embedding in query_embeddings:
+            rows, distances = self.search(embedding, n_results, rows=allowed)
+            result["ids"].append([self.ids[r] for r in rows])
+            result["documents"].append([self.documents[r] for r in rows])
+            result["metadatas"].append([self.metadatas[r] for r in rows])
+            result["distances"].append([float(d) for d in distances])
+        return result
+
+
+class StoredVectors:
+    """Exact float32 vectors of index rows, read on demand from the Chroma collection"""
+
+    def __init__(self, chroma_dir, collection_name, ids):
+        self.chroma_dir = chroma_dir
+        self.collection_name = collection_name
+        self.ids = ids
+        self._collection = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, rows):
+        if self._collection is None:
+            self._collection = chromadb.PersistentClient(path=self.chroma_dir).get_collection(name=self.collection_name)
+        wanted = [self.ids[r] for r in np.atleast_1d(rows)]
+        data = self._collection.get(ids=wanted, include=["embeddings"])
+        by_id = dict(zip(data["ids"], data["embeddings"]))
+        return np.asarray([by_id[chunk_id] for chunk_id in wanted], dtype=np.float32)
+
+
+class CompactIndex(ChunkIndex):
+    """Read-only vector index with a Chroma-compatible `query`"""
+
+    def __init__(self, directory, chroma_dir=None):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(directory, "records.json"), encoding="utf-8") as f:
+            super().__init__(json.load(f))
+
+        self.codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        # Candidates are re-scored against the Chroma collection next to the index;
+        # indexes written before that carry their own vectors.npy copy
+        vectors_path = os.path.join(directory, "vectors.npy")
+        collection_name = self.manifest.get("collection") or (self.manifest.get("source") or {}).get("collection")
+        if os.path.exists(vectors_path):
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+        elif collection_name:
+            self.vectors = StoredVectors(chroma_dir or os.path.dirname(directory), collection_name, self.ids)
+        else:
+            self.vectors = None
+        self.code_norms = np.load(os.path.join(directory, "code_norms.npy"))
+        self.params = {}
+        if self.manifest["mode"] == "int8":
+            self.params["scale"] = np.load(os.path.join(directory, "scale.npy"))
+            self.params["offset"] = np.load(os.path.join(directory, "offset.npy"))
+
+    def approximate_distances(self, query, rows=None):
+        """Squared L2 distances against the compressed codes (of `rows` only, if given)"""
+        if self.codes.dtype == np.int8:
+            # q.x = codes.(q*scale) + q.offset, without decoding every row
+            weights = query * self.params["scale"]
+            bias = float(query @ self.params["offset"])
+        else:
+            weights, bias = query, 0.0
+
+        if rows is not None:
+            # Pre-filtered search only reads the matching rows
+            dots = self.codes[rows].astype(np.float32) @ weights
+            return float(query @ query) - 2.0 * (dots + bias) + self.code_norms[rows]
+
+        dots = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            block = self.codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+            dots[start:start + len(block)] = block @ weights
+        return float(query @ query) - 2.0 * (dots + bias) + self.code_norms
+
+    def search(self, query, n_results=5, rescore=True, rows=None):
+        """Return (row indices, squared L2 distances) of the nearest chunks, optionally among `rows`"""
+        query = np.asarray(query, dtype=np.float32)
+        total = len(self.ids) if rows is None else len(rows)
+        n_results = min(n_results, total)
+        if n_results == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        approx = self.approximate_distances(query, rows)
+        rescore = rescore and self.vectors is not None
+        n_candidates = min(total, n_results * RESCORE_FACTOR if rescore else n_results)
+        positions = np.argpartition(approx, n_candidates - 1)[:n_candidates]
+        candidates = positions if rows is None else rows[positions]
+
+        if rescore:
+            # Re-scoring only reads the candidate rows
+            candidates = np.sort(candidates)
+            diff = np.asarray(self.vectors[candidates], dtype=np.float32) - query
+            distances = np.einsum("ij,ij->i", diff, diff)
+        else:
+            distances = approx[positions]
+
+        order = np.argsort(distances)[:n_results]
+        return candidates[order], distances[order]
+
+
+_loaded = {}
+
+def load_compact_index(db_path):
+    """Cached CompactIndex for a subject DB, or None if it has not been converted"""
+    directory = compact_dir(db_path)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    stamp = os.path.getmtime(manifest_path)
+    cached = _loaded.get(directory)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, CompactIndex(directory))
+        _loaded[directory] = cached
+    return cached[1]
+
+
+# -------- COMPARISON --------
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def compare(db_path, collection_name, n_queries=200, k=5):
+    """Memory / recall@k / latency of fp16 and int8 against exact float32 search"""
+    ids, vectors, documents, metadatas = export_collection(open_published_collection(db_path, collection_name))
+    db_path = resolve_db_path(db_path)
+    # Snapshot versions have no Chroma data to re-score from
+    rescore_from = None if is_snapshot_version(db_path) else collection_name
+    if not ids:
+        print("❌ Collection is empty")
+        return
+
+    # Perturbed stored chunks stand in for real queries
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.02, size=(len(picks), vectors.shape[1])).astype(np.float32)
+
+    exact = []
+    for q in queries:
+        d = np.sum((vectors - q) ** 2, axis=1)
+        exact.append(set(np.argsort(d)[:k]))
+
+    print(f"📊 {db_path} | {len(ids)} chunks x {vectors.shape[1]} dims | recall@{k} on {len(queries)} queries")
+    print(f"   Chroma directory on disk: {directory_size(db_path) / 1e6:.1f} MB "
+          f"(kept next to the compact index)")
+    print(f"   float32 vectors: {vectors.nbytes / 1e6:.2f} MB")
+
+    tmp_root = os.path.join(db_path, "_compact_compare")
+    for mode in ("fp16", "int8"):
+        directory = os.path.join(tmp_root, mode)
+        write_compact_index(directory, ids, vectors, documents, metadatas, mode, collection_name=rescore_from)
+        index = CompactIndex(directory, chroma_dir=db_path)
+        records = os.path.getsize(os.path.join(directory, "records.json"))
+        print(f"   {mode} index on disk: {directory_size(directory) / 1e6:.2f} MB "
+              f"(records.json {records / 1e6:.2f} MB, loaded into RAM)")
+        for rescore in (False, True) if index.vectors is not None else (False,):
+            hits = 0
+            start = time.perf_counter()
+            for q, truth in zip(queries, exact):
+                rows, _ = index.search(q, k, rescore=rescore)
+                hits += len(truth & set(rows.tolist()))
+            elapsed = (time.perf_counter() - start) / len(queries)
+            label = "rescored" if rescore else "approx  "
+            print(f"   {mode} {label}: codes {index.codes.nbytes / 1e6:.2f} MB | "
+                  f"recall@{k} {hits / (k * len(queries)):.3f} | {elapsed * 1000:.2f} ms/query")
+    shutil.rmtree(tmp_root, ignore_errors=True)
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Usage:
+    #   python compact_store.py convert <db_path> <collection_name> [fp16|int8]
+    #   python compact_store.py compare <db_path> <collection_name>
+    if len(sys.argv) < 4 or sys.argv[1] not in ("convert", "compare"):
+        print("Usage: python compact_store.py convert|compare <db_path> <collection_name> [fp16|int8]")
+        sys.exit(1)
+
+    command, db_path, collection_name = sys.argv[1:4]
+    if command == "convert":
+        mode = sys.argv[4] if len(sys.argv) > 4 else "int8"
+        try:
+            manifest = convert_db(db_path, collection_name, mode)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Wrote {manifest['count']} vectors ({mode}) to {compact_dir(resolve_db_path(db_path))}")
+    else:
+        compare(db_path, collection_name)
@@ -0,0 +1,251 @@
+# db_versions.py - Versioned subject DB builds with an atomic "CURRENT" pointer
+# Layout of a subject DB directory (e.g. grade3_gujarati_evs_db/):
+#   CURRENT              -> id of the version the backend serves
+#   versions/<id>/       -> complete Chroma directories, one per build
+# Builders write into a new version, validate it, then swap CURRENT with
+# os.replace, so the live backend never reads a half-built database.
+# Directories without CURRENT (built before versioning) are served as-is.
+import os
+import shutil
+import time
+import uuid
+
+import chromadb
+
+from metadata_index import METADATA_INDEX_FILE, write_metadata_index
+
+# -------- CONFIG --------
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+REBUILD_MARKER = "REBUILD"   # written by clear_guj_collection.py: next build starts empty
+SNAPSHOT_FILE = "snapshot.tsnap"   # a version imported from a snapshot (see index_snapshot.py)
+KEEP_VERSIONS = 2            # current + previous, so in-flight requests can finish
+
+
+# -------- RESOLUTION --------
+def current_version(db_path):
+    """Version id the backend should serve, or None for a legacy (unversioned) DB"""
+    try:
+        with open(os.path.join(db_path, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def is_snapshot_version(db_dir):
+    """Whether a (version) directory was imported from a snapshot
+
+    Such a version has no Chroma data; opening a PersistentClient on it
+    would create an empty chroma.sqlite3 that hides the snapshot.
+    """
+    return os.path.exists(os.path.join(db_dir, SNAPSHOT_FILE))
+
+
+def version_dir(db_path, version_id):
+    return os.path.join(db_path, VERSIONS_DIR, version_id)
+
+
+def resolve_db_path(db_path):
+    """Physical Chroma directory currently published for a subject DB"""
+    version_id = current_version(db_path)
+    return version_dir(db_path, version_id) if version_id else db_path
+
+
+# -------- BUILD --------
+def request_fresh_rebuild(db_path):
+    """Make the next build start empty instead of from the published version"""
+    os.makedirs(db_path, exist_ok=True)
+    with open(os.path.join(db_path, REBUILD_MARKER), "w", encoding="utf-8") as f:
+        f.write(str(int(time.time())))
+
+
+def rebuild_requested(db_path):
+    """True if clear_guj_collection.py asked for the next build to start empty"""
+    return os.path.exists(os.path.join(db_path, REBUILD_MARKER))
+
+
+def create_build_dir(db_path, fresh=False):
+    """Create a new, unpublished version and return (version_id, build_dir)
+
+    Incremental builds start from a copy of the published version's Chroma
+    data (or of a legacy DB directory, or the chunks of an imported
+    snapshot); fresh builds start empty. Derived
+    indexes are not copied: they would hide the chunks the build adds, and
+    finish_build regenerates them.
+    """
+    fresh = fresh or rebuild_requested(db_path)
+
+    version_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    build_dir = version_dir(db_path, version_id)
+    source = resolve_db_path(db_path)
+
+    # (imported here because index_snapshot imports this module)
+    from index_snapshot import materialize_snapshot
+
+    if not fresh and is_snapshot_version(source):
+        # Published version was imported from a snapshot: start from its chunks
+        # (checked first: a stray chroma.sqlite3 next to it would be empty)
+        os.makedirs(build_dir)
+        materialize_snapshot(source, build_dir)
+    elif not fresh and os.path.exists(os.path.join(source, "chroma.sqlite3")):
+        shutil.copytree(
+            source,
+            build_dir,
+            ignore=shutil.ignore_patterns(
+                VERSIONS_DIR, CURRENT_FILE, REBUILD_MARKER, ".db_version*",
+                "compact", "*.tsnap", METADATA_INDEX_FILE,
+            ),
+        )
+    else:
+        os.makedirs(build_dir)
+    return version_id, build_dir
+
+
+def collection_count(db_dir, collection_name):
+    """Chunks in a collection (or imported snapshot), or 0 if the directory/collection does not exist"""
+    if is_snapshot_version(db_dir):
+        from index_snapshot import snapshot_count
+
+        return snapshot_count(db_dir)
+    if not os.path.exists(os.path.join(db_dir, "chroma.sqlite3")):
+        return 0
+    try:
+        return chromadb.PersistentClient(path=db_dir).get_collection(name=collection_name).count()
+    except Exception:
+        return 0
+
+
+def open_published_collection(db_path, collection_name):
+    """Chunks of the published version for offline tools: its SnapshotIndex or Chroma collection"""
+    db_dir = resolve_db_path(db_path)
+    if is_snapshot_version(db_dir):
+        # (imported here because index_snapshot imports this module)
+        from index_snapshot import SnapshotIndex
+
+        return SnapshotIndex(os.path.join(db_dir, SNAPSHOT_FILE))
+    return chromadb.PersistentClient(path=db_dir).get_collection(name=collection_name)
+
+
+def validate_build(build_dir, collection_name, min_count=1):
+    """Count and smoke-query check of a build; returns (ok, message)"""
+    try:
+        collection = chromadb.PersistentClient(path=build_dir).get_collection(name=collection_name)
+    except Exception as e:
+        return False, f"collection '{collection_name}' missing: {e}"
+
+    count = collection.count()
+    if count < min_count:
+        return False, f"only {count} chunks (expected at least {min_count})"
+
+    # A stored chunk queried with its own embedding must come back (or an exact duplicate)
+    sample = collection.get(limit=1, include=["embeddings"])
+    results = collection.query(
+        query_embeddings=[sample["embeddings"][0]],
+        n_results=1,
+        include=["distances"],
+    )
+    if not results["ids"][0] or (results["ids"][0][0] != sample["ids"][0] and results["distances"][0][0] > 1e-6):
+        return False, "smoke query did not return the sampled chunk"
+    return True, f"{count} chunks, smoke query ok"
+
+
+# -------- PUBLISH --------
+def publish_version(db_path, version_id):
+    """Atomically point CURRENT at a validated version"""
+    tmp_path = os.path.join(db_path, f"{CURRENT_FILE}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version_id)
+    os.replace(tmp_path, os.path.join(db_path, CURRENT_FILE))
+
+
+def discard_version(db_path, version_id):
+    """Delete an unpublished build that failed validation"""
+    if version_id != current_version(db_path):
+        shutil.rmtree(version_dir(db_path, version_id), ignore_errors=True)
+
+
+def collect_garbage(db_path, keep=KEEP_VERSIONS):
+    """Delete all but the newest `keep` versions (never the published one)"""
+    root = os.path.join(db_path, VERSIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    current = current_version(db_path)
+    versions = sorted(os.listdir(root), reverse=True)
+    removed = []
+    for version_id in versions[keep:]:
+        if version_id == current:
+            continue
+        # On Windows a version still open elsewhere cannot be removed yet;
+        # it is retried on the next publish.
+        shutil.rmtree(os.path.join(root, version_id), ignore_errors=True)
+        if not os.path.exists(os.path.join(root, version_id)):
+            removed.append(version_id)
+        else:
+            print(f"⚠️ Could not remove old version {version_id} (still open?); retrying on the next publish")
+    return removed
+
+
+def release_version(version_path):
+    """Close this process's cached Chroma system for a superseded version directory
+
+    chromadb keeps one system per path for the life of the process (holding
+    its files open, which locks them on Windows), so without this a version
+    the backend once served could never be garbage-collected.
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    target = os.path.normpath(version_path)
+    for identifier in list(SharedSystemClient._identifier_to_system):
+        if identifier and os.path.normpath(identifier) == target:
+            system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+            SharedSystemClient._identifier_to_refcount.pop(identifier, None)
+            if system is not None:
+                system.stop()
+
+
+def finish_build(db_path, version_id, collection_name, min_count=1):
+    """Validate a build, publish it and garbage-collect old versions"""
+    ok, message = validate_build(version_dir(db_path, version_id), collection_name, min_count)
+    if not ok:
+        discard_version(db_path, version_id)
+        print(f"❌ Build {version_id} rejected: {message}")
+        return False
+
+    # Chapter listing / filters / neighbours, precomputed for the backend
+    build_dir = version_dir(db_path, version_id)
+    index = write_metadata_index(
+        build_dir,
+        chromadb.PersistentClient(path=build_dir).get_collection(name=collection_name),
+        collection_name,
+    )
+
+    # FAQ entries move to the new version; the backend skips those of changed chapters
+    # (imported here because faq_index imports this module)
+    from faq_index import carry_over_faq
+
+    copied, stale = carry_over_faq(
+        resolve_db_path(db_path), build_dir, {c["chapter"]: c["fingerprint"] for c in index["chapters"]}
+    )
+    if copied:
+        print(f"📋 Carried {copied} FAQ entries over to version {version_id}")
+    if stale:
+        print(f"⚠️ FAQ entries of {len(stale)} changed chapters are not served until "
+              f"`python faq_index.py {db_path} <language>` is re-run: {', '.join(stale)}")
+
+    # A DB served from a compact index keeps being served that way, from the new contents
+    # (imported here because compact_store imports this module)
+    from compact_store import compact_mode, convert_dir
+
+    mode = compact_mode(resolve_db_path(db_path))
+    if mode:
+        convert_dir(build_dir, collection_name, mode, source={"db_path": db_path, "collection": collection_name})
+
+    publish_version(db_path, version_id)
+    marker = os.path.join(db_path, REBUILD_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+    removed = collect_garbage(db_path)
+    print(f"✅ Published {os.path.basename(db_path)} version {version_id} ({message})")
+    if removed:
+        print(f"🗑️ Removed old versions: {', '.join(removed)}")
+    return True
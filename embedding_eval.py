@@ -0,0 +1,219 @@
+# embedding_eval.py - Offline comparison of embedding models on the bundled textbooks
+# Builds one candidate index per model from a folder of chapter PDFs (chunked
+# like vectordb.py), runs a labelled question set against each and reports
+# recall@k, MRR, encode throughput and memory, then recommends a model.
+#
+# Question set: JSON lines with "question", "pdf_file" and "evidence" (a short
+# phrase from the textbook); a retrieved chunk is relevant if it comes from that
+# PDF and contains the phrase. See eval/grade3_evs_questions.jsonl.
+import argparse
+import json
+import os
+import re
+import time
+
+import chromadb
+import fitz  # PyMuPDF
+from sentence_transformers import SentenceTransformer
+
+from embedding_models import EMBEDDING_MODELS, canonical_model_name, model_metadata
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# -------- CONFIG --------
+CANDIDATES = [
+    {"model": "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"},
+    {"model": "sentence-transformers/all-MiniLM-L6-v2"},
+    {"model": "intfloat/multilingual-e5-base"},
+    # e5 is trained with these prefixes; the backend does not add them, so this
+    # variant is reported for reference but not recommended
+    {"model": "intfloat/multilingual-e5-base", "query_prefix": "query: ", "passage_prefix": "passage: ",
+     "label": "multilingual-e5-base + prefixes"},
+]
+
+K_VALUES = (1, 3, 5, 10)
+SELECT_K = 3               # recall@k used for the recommendation (English retrieval keeps 3)
+CHUNK_SIZE, CHUNK_OVERLAP = 500, 50   # same as vectordb.py
+ENCODE_BATCH_SIZE = 64
+
+
+# -------- CORPUS --------
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split text into chunks with overlap (as in vectordb.py)"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        chunks.append(text[start:start + chunk_size])
+        start += chunk_size - overlap
+    return chunks
+
+
+def load_corpus(pdf_folder):
+    """Chunks and metadata for every chapter PDF in a folder"""
+    documents, metadatas = [], []
+    for filename in sorted(os.listdir(pdf_folder)):
+        if not filename.endswith(".pdf"):
+            continue
+        doc = fitz.open(os.path.join(pdf_folder, filename))
+        full_text = ""
+        for page_num, page in enumerate(doc, start=1):
+            text = page.get_text("text")
+            if text.strip():
+                full_text += f"\n\nPage {page_num}:\n{text}"
+        for i, chunk in enumerate(chunk_text(full_text)):
+            documents.append(chunk)
+            metadatas.append({"pdf_file": filename, "chapter": os.path.splitext(filename)[0], "chunk_index": i})
+    return documents, metadatas
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def load_questions(path, documents, metadatas):
+    """Labelled questions with the set of relevant chunk rows for each"""
+    normalized = [normalize(doc) for doc in documents]
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            evidence = normalize(item["evidence"])
+            relevant = {
+                row for row, (text, meta) in enumerate(zip(normalized, metadatas))
+                if meta["pdf_file"] == item["pdf_file"] and evidence in text
+            }
+            if not relevant:
+                print(f"   ⚠️ No chunk contains the evidence for: {item['question']}")
+                continue
+            questions.append((item["question"], relevant))
+    return questions
+
+
+# -------- EVALUATION --------
+def rss_mb():
+    return psutil.Process().memory_info().rss / 1e6 if psutil else None
+
+
+def evaluate(candidate, documents, metadatas, questions, persist_dir=None):
+    """Build the candidate index, run the questions and measure cost"""
+    name = canonical_model_name(candidate["model"])
+    query_prefix = candidate.get("query_prefix", "")
+    passage_prefix = candidate.get("passage_prefix", "")
+    rss_before = rss_mb()
+
+    start = time.perf_counter()
+    model = SentenceTransformer(name)
+    load_seconds = time.perf_counter() - start
+    param_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 1e6
+    model.encode(["warm up"])
+
+    start = time.perf_counter()
+    vectors = model.encode(
+        [passage_prefix + doc for doc in documents], batch_size=ENCODE_BATCH_SIZE
+    ).tolist()
+    passages_per_second = len(documents) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    query_vectors = model.encode([query_prefix + q for q, _ in questions]).tolist()
+    queries_per_second = len(questions) / (time.perf_counter() - start)
+
+    # Candidate index, with the model identity recorded as in real builds
+    label = candidate.get("label", name.split("/")[-1])
+    if persist_dir:
+        client = chromadb.PersistentClient(path=os.path.join(persist_dir, re.sub(r"\W+", "_", label)))
+    else:
+        client = chromadb.EphemeralClient()
+    try:
+        client.delete_collection("textbook_db")
+    except Exception:
+        pass
+    collection = client.create_collection(name="textbook_db", metadata=model_metadata(name))
+    ids = [f"{m['chapter']}_{m['chunk_index']}" for m in metadatas]
+    for start in range(0, len(ids), 1000):
+        collection.add(
+            ids=ids[start:start + 1000],
+            embeddings=vectors[start:start + 1000],
+            documents=documents[start:start + 1000],
+            metadatas=metadatas[start:start + 1000],
+        )
+
+    rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+    results = collection.query(query_embeddings=query_vectors, n_results=max(K_VALUES), include=[])
+    hits = {k: 0 for k in K_VALUES}
+    reciprocal_ranks = 0.0
+    for (_, relevant), result_ids in zip(questions, results["ids"]):
+        ranks = [rank for rank, chunk_id in enumerate(result_ids, start=1) if rows[chunk_id] in relevant]
+        if ranks:
+            reciprocal_ranks += 1 / ranks[0]
+        for k in K_VALUES:
+            hits[k] += bool(ranks and ranks[0] <= k)
+
+    rss_after = rss_mb()
+    return {
+        "label": label,
+        "model": name,
+        "prefixed": bool(query_prefix or passage_prefix),
+        "recall": {k: hits[k] / len(questions) for k in K_VALUES},
+        "mrr": reciprocal_ranks / len(questions),
+        "passages_per_second": passages_per_second,
+        "queries_per_second": queries_per_second,
+        "load_seconds": load_seconds,
+        "param_mb": param_mb,
+        "index_mb": len(vectors) * len(vectors[0]) * 4 / 1e6,
+        "rss_delta_mb": rss_after - rss_before if psutil else None,
+    }
+
+
+def recommend(reports, select_k=SELECT_K):
+    """Best recall@k among deployable candidates; faster encoding breaks ties"""
+    deployable = [r for r in reports if not r["prefixed"]]
+    return max(deployable, key=lambda r: (round(r["recall"][select_k], 3), r["passages_per_second"]))
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare embedding models on textbook retrieval")
+    parser.add_argument("pdf_folder", help="folder of chapter PDFs (one subject DB)")
+    parser.add_argument("questions", help="labelled questions (.jsonl)")
+    parser.add_argument("--models", help="comma-separated models instead of the default candidates")
+    parser.add_argument("--language", default="english", choices=sorted(EMBEDDING_MODELS))
+    parser.add_argument("--persist", help="keep the candidate indexes under this directory")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    candidates = [{"model": m.strip()} for m in args.models.split(",")] if args.models else CANDIDATES
+
+    print(f"📚 Loading {args.pdf_folder}")
+    documents, metadatas = load_corpus(args.pdf_folder)
+    questions = load_questions(args.questions, documents, metadatas)
+    print(f"   {len(documents)} chunks, {len(questions)} labelled questions")
+
+    reports = []
+    for candidate in candidates:
+        print(f"\n🔎 {candidate.get('label', candidate['model'])}")
+        reports.append(evaluate(candidate, documents, metadatas, questions, args.persist))
+
+    print(f"\n{'model':36s} " + " ".join(f"R@{k:<3d}" for k in K_VALUES) +
+          "   MRR   passages/s  queries/s  params MB  index MB  RSS Δ MB")
+    for r in reports:
+        rss = f"{r['rss_delta_mb']:8.0f}" if r["rss_delta_mb"] is not None else "       -"
+        print(f"{r['label'][:36]:36s} " + " ".join(f"{r['recall'][k]:.2f} " for k in K_VALUES) +
+              f"  {r['mrr']:.3f} {r['passages_per_second']:11.1f} {r['queries_per_second']:10.1f} "
+              f"{r['param_mb']:10.0f} {r['index_mb']:9.1f} {rss}")
+
+    best = recommend(reports)
+    current = canonical_model_name(EMBEDDING_MODELS[args.language])
+    print(f"\n✅ Recommended for {args.language}: {best['model']} (recall@{SELECT_K} {best['recall'][SELECT_K]:.2f})")
+    if best["model"] != current:
+        print(f"   Currently configured: {current}. To switch, set EMBEDDING_MODELS['{args.language}'] in "
+              f"embedding_models.py and run:\n"
+              f"   python embedding_models.py reembed <path-to-subject-db> <collection_name> {best['model']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"pdf_folder": args.pdf_folder, "reports": reports, "recommended": best["model"]}, f, indent=2)
@@ -0,0 +1,119 @@
+# embedding_models.py - One place for the embedding model of each language
+# Builders record the model they embedded with in the collection metadata, and
+# the backend refuses a DB whose recorded model differs from the one it embeds
+# queries with (distances between vectors of different models are meaningless).
+# `python embedding_models.py reembed ...` rebuilds a DB with another model.
+import sys
+
+# -------- CONFIG --------
+# Used both to build the DBs and to embed queries against them
+EMBEDDING_MODELS = {
+    "english": "sentence-transformers/multi-qa-MiniLM-L6-cos-v1",
+    "gujarati": "intfloat/multilingual-e5-base",
+}
+
+# Collection metadata key holding the model identity
+MODEL_METADATA_KEY = "embedding_model"
+
+# DBs built before the identity was recorded were embedded with these
+LEGACY_MODELS = {
+    "textbook_db": "sentence-transformers/multi-qa-MiniLM-L6-cos-v1",
+    "gujarati_textbook_db": "intfloat/multilingual-e5-base",
+}
+
+REEMBED_BATCH_SIZE = 256
+
+
+# -------- IDENTITY --------
+def canonical_model_name(name):
+    """'all-MiniLM-L6-v2' and 'sentence-transformers/all-MiniLM-L6-v2' are the same model"""
+    if name and "/" not in name:
+        return f"sentence-transformers/{name}"
+    return name
+
+
+def model_metadata(model_name, extra=None):
+    """Collection metadata recording the embedding model"""
+    metadata = dict(extra or {})
+    metadata[MODEL_METADATA_KEY] = canonical_model_name(model_name)
+    return metadata
+
+
+def record_model(collection, model_name):
+    """Record (or update) the model identity on an existing Chroma collection"""
+    # hnsw:* settings cannot be passed to modify(); they are kept as they are
+    metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    collection.modify(metadata=model_metadata(model_name, metadata))
+
+
+def stored_model(collection, collection_name=None):
+    """Model a collection (or compact/snapshot index) was embedded with, if known"""
+    manifest = getattr(collection, "manifest", None)
+    if manifest is not None:
+        name = manifest.get(MODEL_METADATA_KEY)
+    else:
+        name = (getattr(collection, "metadata", None) or {}).get(MODEL_METADATA_KEY)
+    if not name and collection_name:
+        name = LEGACY_MODELS.get(collection_name)
+    return canonical_model_name(name) if name else None
+
+
+def check_model(collection, collection_name, query_model):
+    """(ok, stored model) for querying a collection with `query_model`"""
+    stored = stored_model(collection, collection_name)
+    return stored is None or stored == canonical_model_name(query_model), stored
+
+
+# -------- RE-EMBED --------
+def reembed_db(db_path, collection_name, model_name):
+    """Rebuild a subject DB with another embedding model as a new published version"""
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+
+    from db_versions import create_build_dir, finish_build, open_published_collection
+    from metadata_index import read_chunks
+
+    ids, documents, metadatas = read_chunks(open_published_collection(db_path, collection_name))
+    data = {"ids": ids, "documents": documents, "metadatas": [m or None for m in metadatas]}
+    model = SentenceTransformer(canonical_model_name(model_name))
+
+    version_id, build_dir = create_build_dir(db_path, fresh=True)
+    target = chromadb.PersistentClient(path=build_dir).get_or_create_collection(
+        name=collection_name,
+        metadata=model_metadata(model_name),
+    )
+    for start in range(0, len(data["ids"]), REEMBED_BATCH_SIZE):
+        end = start + REEMBED_BATCH_SIZE
+        target.add(
+            ids=data["ids"][start:end],
+            documents=data["documents"][start:end],
+            metadatas=data["metadatas"][start:end],
+            embeddings=model.encode(data["documents"][start:end]).tolist(),
+        )
+        print(f"   Re-embedded {min(end, len(data['ids']))}/{len(data['ids'])} chunks")
+    return finish_build(db_path, version_id, collection_name)
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Usage: python embedding_models.py reembed <db_path> <collection_name> <model>
+    #        python embedding_models.py show <db_path> <collection_name>
+    if len(sys.argv) < 4 or sys.argv[1] not in ("reembed", "show"):
+        print("Usage:\n"
+              "  python embedding_models.py show <db_path> <collection_name>\n"
+              "  python embedding_models.py reembed <db_path> <collection_name> <model>")
+        sys.exit(1)
+
+    if sys.argv[1] == "show":
+        from db_versions import open_published_collection
+
+        collection = open_published_collection(sys.argv[2], sys.argv[3])
+        if stored_model(collection):
+            print(f"{sys.argv[3]}: {stored_model(collection)}")
+        else:
+            print(f"{sys.argv[3]}: not recorded (assumed {stored_model(collection, sys.argv[3])})")
+    else:
+        if len(sys.argv) < 5:
+            print("Usage: python embedding_models.py reembed <db_path> <collection_name> <model>")
+            sys.exit(1)
+        sys.exit(0 if reembed_db(sys.argv[2], sys.argv[3], sys.argv[4]) else 1)
@@ -0,0 +1,350 @@
+# faq_index.py - Precompute likely question -> answer pairs per chapter
+# Run after vectordb.py / vectordb_guj_batch.py so frequent questions can be
+# answered straight from this index without retrieval + LLM generation.
+# Chapters are the ones metadata_index.py lists; every entry stores the
+# fingerprint of the chapter text it was generated from, and the backend
+# ignores entries whose chapter has changed since (re-run this script to
+# regenerate them). Like the ingestion scripts it builds a new DB version and
+# publishes it with finish_build; later builds carry the FAQ entries over.
+import json
+import os
+import re
+import sys
+import time
+
+import chromadb
+import numpy as np
+from groq import Groq
+from sentence_transformers import SentenceTransformer
+
+from db_versions import (
+    collection_count,
+    create_build_dir,
+    discard_version,
+    finish_build,
+    is_snapshot_version,
+    rebuild_requested,
+    resolve_db_path,
+)
+from embedding_models import EMBEDDING_MODELS, canonical_model_name, record_model, stored_model
+from metadata_index import chapter_fingerprint, group_by_chapter, read_chunks
+
+# -------- CONFIG --------
+# Collection stored next to the textbook collection inside each subject DB
+FAQ_COLLECTION = "faq_index"
+
+# Query -> stored question distance below which the cached answer is served, per
+# query model (multilingual-e5 packs all texts into a narrow band of distances).
+# Each build lowers it to the distance below which questions of *different*
+# chapters almost never come (FAQ_SEPARATION_PERCENTILE), stored on the collection.
+FAQ_MATCH_THRESHOLDS = {
+    "sentence-transformers/multi-qa-MiniLM-L6-cos-v1": 0.35,
+    "sentence-transformers/all-MiniLM-L6-v2": 0.35,
+    "intfloat/multilingual-e5-base": 0.12,
+}
+DEFAULT_FAQ_MATCH_THRESHOLD = 0.12
+FAQ_SEPARATION_PERCENTILE = 5
+THRESHOLD_METADATA_KEY = "match_threshold"
+
+# Closest stored questions checked per query (entries of changed chapters are skipped)
+FAQ_CANDIDATES = 3
+
+# Number of question/answer pairs to generate per chapter
+QUESTIONS_PER_CHAPTER = 8
+
+# Limit the chapter text sent to the LLM (characters)
+MAX_CHAPTER_CHARS = 6000
+
+LLM_MODEL = "llama-3.3-70b-versatile"
+
+# FAQ collections built before the model identity was recorded used these
+# (queries are embedded with embedding_models.EMBEDDING_MODELS, as in backend.py)
+LEGACY_FAQ_MODELS = {
+    "english": "sentence-transformers/all-MiniLM-L6-v2",
+    "gujarati": "intfloat/multilingual-e5-base",
+}
+
+
+# -------- CHAPTER GROUPING --------
+def group_chunks_by_chapter(collection):
+    """Return {chapter: [chunk text, ...]} in reading order (chapters as in metadata_index.py)"""
+    return {
+        chapter: [doc for _, doc, _ in chunks]
+        for chapter, chunks in group_by_chapter(*read_chunks(collection)).items()
+    }
+
+
+# -------- QUESTION GENERATION --------
+def generate_qa_pairs(groq_client, chapter_text, language, n_questions=QUESTIONS_PER_CHAPTER):
+    """Ask the LLM for likely student questions with answers taken from the chapter"""
+    if language == "gujarati":
+        instructions = (
+            "You are a kind Gujarati teacher for primary school students. "
+            f"Read the textbook chapter below and write the {n_questions} questions a child aged 5-8 "
+            "is most likely to ask about it, each with a simple answer. Questions and answers MUST be "
+            "in Gujarati (ગુજરાતી ભાષામાં) and use ONLY the chapter text."
+        )
+    else:
+        instructions = (
+            "You are a kind teacher for primary school students of India. "
+            f"Read the textbook chapter below and write the {n_questions} questions a child aged 5-8 "
+            "is most likely to ask about it, each with a simple, clear answer that uses ONLY the chapter text."
+        )
+
+    completion = groq_client.chat.completions.create(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": instructions + ' Reply with a JSON list only: [{"question": "...", "answer": "..."}]'},
+            {"role": "user", "content": chapter_text[:MAX_CHAPTER_CHARS]},
+        ],
+        temperature=0,
+        top_p=0.9,
+    )
+    return parse_qa_pairs(completion.choices[0].message.content)
+
+
+def parse_qa_pairs(raw):
+    """Extract the JSON list of question/answer pairs from an LLM reply"""
+    match = re.search(r"\[.*\]", raw, re.DOTALL)
+    if not match:
+        return []
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return []
+
+    pairs = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        question = str(item.get("question", "")).strip()
+        answer = str(item.get("answer", "")).strip()
+        if question and answer:
+            pairs.append((question, answer))
+    return pairs
+
+
+# -------- INDEX BUILD --------
+def faq_model(faq_collection, language):
+    """Embedding model the stored FAQ questions were encoded with"""
+    return stored_model(faq_collection) or LEGACY_FAQ_MODELS[language]
+
+
+def calibrate_threshold(faq_collection, model_name):
+    """Match threshold for a FAQ collection: the model default, lowered to the
+    distance below which only FAQ_SEPARATION_PERCENTILE % of questions have a
+    question of another chapter (such a match would serve the wrong answer)
+    """
+    default = FAQ_MATCH_THRESHOLDS.get(model_name, DEFAULT_FAQ_MATCH_THRESHOLD)
+    entries = faq_collection.get(include=["embeddings", "metadatas"])
+    if len({meta["chapter"] for meta in entries["metadatas"]}) < 2:
+        return default
+
+    # Same distance as the collection's queries return
+    vectors = np.asarray(entries["embeddings"], dtype=np.float32)
+    space = (faq_collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "cosine":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    dots = vectors @ vectors.T
+    if space == "l2":
+        squared = np.einsum("ij,ij->i", vectors, vectors)
+        distances = squared[:, None] + squared[None, :] - 2 * dots
+    else:
+        distances = 1.0 - dots
+    chapters = np.array([meta["chapter"] for meta in entries["metadatas"]])
+    distances[chapters[:, None] == chapters[None, :]] = np.inf
+    nearest_other = distances.min(axis=1)
+    return min(default, float(np.percentile(nearest_other, FAQ_SEPARATION_PERCENTILE)))
+
+
+def faq_threshold(faq_collection):
+    """Match threshold calibrated at build time, or the default of the collection's model"""
+    threshold = (faq_collection.metadata or {}).get(THRESHOLD_METADATA_KEY)
+    if threshold is not None:
+        return threshold
+    return FAQ_MATCH_THRESHOLDS.get(stored_model(faq_collection), DEFAULT_FAQ_MATCH_THRESHOLD)
+
+
+def build_faq_index(db_path, source_collection_name, language, groq_client, model, force=False):
+    """Generate FAQ entries for new or changed chapters and drop entries for removed chapters
+
+    Works on a new version of the subject DB (db_path is its root directory)
+    and publishes it; returns the number of generated questions.
+    """
+    if rebuild_requested(db_path):
+        raise ValueError(f"{db_path} is waiting for a fresh rebuild; re-ingest it before building the FAQ index")
+
+    min_count = collection_count(resolve_db_path(db_path), source_collection_name)
+    version_id, build_dir = create_build_dir(db_path)
+    try:
+        generated = update_faq_entries(build_dir, source_collection_name, language, groq_client, model, force)
+    except BaseException:
+        discard_version(db_path, version_id)
+        raise
+    if not finish_build(db_path, version_id, source_collection_name, min_count=max(min_count, 1)):
+        raise RuntimeError(f"FAQ build of {db_path} was rejected")
+    return generated
+
+
+def update_faq_entries(build_dir, source_collection_name, language, groq_client, model, force=False):
+    """Bring the FAQ collection of an unpublished build up to date with its chapters"""
+    client = chromadb.PersistentClient(path=build_dir)
+    source = client.get_collection(name=source_collection_name)
+    faq = client.get_or_create_collection(name=FAQ_COLLECTION)
+
+    # The query model changed: re-embed the stored questions, no need to regenerate them
+    model_name = canonical_model_name(EMBEDDING_MODELS[language])
+    if faq.count() and faq_model(faq, language) != model_name:
+        entries = faq.get(include=["documents"])
+        faq.update(ids=entries["ids"], embeddings=model.encode(entries["documents"]).tolist())
+        print(f"   🔁 Re-embedded {len(entries['ids'])} stored questions with {model_name}")
+    record_model(faq, model_name)
+
+    chapters = group_chunks_by_chapter(source)
+
+    # Fingerprints of the chapters the current FAQ entries were generated from
+    existing = faq.get(include=["metadatas"])
+    stored = {}
+    for meta in existing["metadatas"]:
+        stored[meta["chapter"]] = meta["fingerprint"]
+
+    generated = 0
+    for chapter, chunks in chapters.items():
+        fingerprint = chapter_fingerprint(chunks)
+        if not force and stored.get(chapter) == fingerprint:
+            print(f"   ⏭️  {chapter}: up to date")
+            continue
+
+        pairs = generate_qa_pairs(groq_client, "\n".join(chunks), language)
+        faq.delete(where={"chapter": chapter})
+        if not pairs:
+            print(f"   ⚠️ {chapter}: no questions generated")
+            continue
+
+        questions = [q for q, _ in pairs]
+        faq.add(
+            documents=questions,
+            embeddings=model.encode(questions).tolist(),
+            metadatas=[{
+                "chapter": chapter,
+                "fingerprint": fingerprint,
+                "answer": answer,
+                "generated_at": int(time.time()),
+            } for _, answer in pairs],
+            ids=[f"{chapter}_faq_{i}" for i in range(len(pairs))],
+        )
+        generated += len(pairs)
+        print(f"   ✓ {chapter}: {len(pairs)} questions")
+
+    for chapter in set(stored) - set(chapters):
+        faq.delete(where={"chapter": chapter})
+        print(f"   🗑️ {chapter}: removed (chapter no longer in DB)")
+
+    threshold = calibrate_threshold(faq, model_name)
+    metadata = {k: v for k, v in (faq.metadata or {}).items() if not k.startswith("hnsw:")}
+    faq.modify(metadata={**metadata, THRESHOLD_METADATA_KEY: threshold})
+    print(f"   📏 Match threshold {threshold:.3f} ({model_name})")
+    return generated
+
+
+def carry_over_faq(source_dir, build_dir, fingerprints):
+    """Copy the FAQ entries of the published version into a new build
+
+    Returns (entries copied, chapters whose entries no longer match the build).
+    Fresh builds start empty and would otherwise lose the FAQ index; entries of
+    changed chapters are copied too but not served until faq_index.py is re-run.
+    """
+    if is_snapshot_version(source_dir) or not os.path.exists(os.path.join(source_dir, "chroma.sqlite3")):
+        return 0, []
+    build = chromadb.PersistentClient(path=build_dir)
+    try:
+        # Incremental builds copied it with the rest of the Chroma data
+        entries = build.get_collection(name=FAQ_COLLECTION).get(include=["metadatas"])
+        copied = 0
+    except Exception:
+        try:
+            source = chromadb.PersistentClient(path=source_dir).get_collection(name=FAQ_COLLECTION)
+        except Exception:
+            return 0, []
+        entries = source.get(include=["embeddings", "documents", "metadatas"])
+        if not entries["ids"]:
+            return 0, []
+        metadata = {k: v for k, v in (source.metadata or {}).items() if not k.startswith("hnsw:")}
+        build.create_collection(name=FAQ_COLLECTION, metadata=metadata or None).add(
+            ids=entries["ids"],
+            embeddings=entries["embeddings"],
+            documents=entries["documents"],
+            metadatas=entries["metadatas"],
+        )
+        copied = len(entries["ids"])
+
+    stale = sorted({
+        meta["chapter"] for meta in entries["metadatas"]
+        if fingerprints.get(meta["chapter"]) != meta["fingerprint"]
+    })
+    return copied, stale
+
+
+# -------- LOOKUP --------
+def load_faq_collection(db_path, language):
+    """Open the FAQ collection of a subject DB, or None if it was never built or is stale"""
+    if is_snapshot_version(db_path) or not os.path.exists(os.path.join(db_path, "chroma.sqlite3")):
+        # Snapshot versions carry no FAQ; don't create an empty Chroma DB in them
+        return None
+    try:
+        faq = chromadb.PersistentClient(path=db_path).get_collection(name=FAQ_COLLECTION)
+    except Exception:
+        return None
+    if faq_model(faq, language) != canonical_model_name(EMBEDDING_MODELS[language]):
+        print(f"FAQ index in {db_path} was embedded with {faq_model(faq, language)}; re-run faq_index.py")
+        return None
+    return faq
+
+
+def lookup_faq(faq_collection, query_embedding, fingerprints, threshold=None):
+    """Return the stored answer for the closest precomputed question, if close enough
+
+    `fingerprints` ({chapter: fingerprint}, see metadata_index.py) describe the
+    served DB version; entries generated from other chapter text are skipped.
+    """
+    if faq_collection is None or faq_collection.count() == 0:
+        return None
+    if threshold is None:
+        threshold = faq_threshold(faq_collection)
+    results = faq_collection.query(
+        query_embeddings=[query_embedding],
+        n_results=min(FAQ_CANDIDATES, faq_collection.count()),
+        include=["metadatas", "distances"],
+    )
+    for meta, distance in zip(results["metadatas"][0], results["distances"][0]):
+        if distance >= threshold:
+            break
+        if fingerprints.get(meta["chapter"]) == meta["fingerprint"]:
+            return meta["answer"]
+    return None
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Usage: python faq_index.py <db_path> <english|gujarati> [--force]
+    if len(sys.argv) < 3:
+        print("Usage: python faq_index.py <db_path> <english|gujarati> [--force]")
+        sys.exit(1)
+
+    db_path, language = sys.argv[1], sys.argv[2].lower()
+    collection_name = "gujarati_textbook_db" if language == "gujarati" else "textbook_db"
+
+    print(f"📚 Building FAQ index for {db_path} ({language})")
+    try:
+        count = build_faq_index(
+            db_path,
+            collection_name,
+            language,
+            Groq(api_key="YOUR_API_KEY"),
+            SentenceTransformer(EMBEDDING_MODELS[language]),
+            force="--force" in sys.argv,
+        )
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ Generated {count} question/answer pairs")
@@ -1,12 +1,13 @@
 from groq import Groq
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_models import EMBEDDING_MODELS
 
 # Path to your ChromaDB folder
 DB_PATH = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\vector_db\grade3_evs_db"
 
 # Load embeddings and Chroma vector database
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODELS["english"])  # MUST match vectordb.py
 db = Chroma(
     persist_directory=DB_PATH,
     collection_name="textbook_db",   # MUST match vectordb.py
@@ -0,0 +1,288 @@
+# index_snapshot.py - Portable single-file snapshots of subject indexes
+# A snapshot packs vectors, chunk text, metadata and a manifest (embedding model,
+# checksum) into one file. New nodes import it as a published DB version and the
+# backend memory-maps it, so nothing is re-embedded or re-indexed on startup.
+#
+# File layout:
+#   8 bytes   magic b"TSNAP1\0\0"
+#   8 bytes   manifest length (little-endian uint64)
+#   manifest  UTF-8 JSON, padded with spaces to a 64-byte boundary
+#   payload   vectors (N x D, float32 or float16), then records JSON
+#             (offsets in the manifest are relative to the payload start)
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import time
+
+import chromadb
+import numpy as np
+
+from compact_store import EXPORT_BATCH_SIZE, ChunkIndex, export_collection
+from db_versions import (
+    SNAPSHOT_FILE,
+    collect_garbage,
+    create_build_dir,
+    discard_version,
+    open_published_collection,
+    publish_version,
+)
+from embedding_models import model_metadata, stored_model
+from metadata_index import write_metadata_index
+
+# -------- CONFIG --------
+MAGIC = b"TSNAP1\0\0"
+ALIGNMENT = 64
+SCAN_BLOCK_ROWS = 8192
+
+
+# -------- EXPORT --------
+def export_snapshot(db_path, collection_name, out_path, model_name=None, fp16=False):
+    """Pack the published version of a subject DB (Chroma or an imported snapshot) into one snapshot file"""
+    collection = open_published_collection(db_path, collection_name)
+    ids, vectors, documents, metadatas = export_collection(collection)
+
+    model_name = model_name or stored_model(collection, collection_name)
+    vectors = vectors.astype(np.float16 if fp16 else np.float32)
+    vector_bytes = vectors.tobytes()
+    record_bytes = json.dumps(
+        {"ids": ids, "documents": documents, "metadatas": metadatas}, ensure_ascii=False
+    ).encode("utf-8")
+
+    digest = hashlib.sha256()
+    digest.update(vector_bytes)
+    digest.update(record_bytes)
+
+    manifest = {
+        "format": 1,
+        "collection": collection_name,
+        "embedding_model": model_name,
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if len(ids) else 0,
+        "dtype": str(vectors.dtype),
+        "vectors_offset": 0,
+        "vectors_nbytes": len(vector_bytes),
+        "records_offset": len(vector_bytes),
+        "records_nbytes": len(record_bytes),
+        "sha256": digest.hexdigest(),
+        "source": os.path.basename(os.path.normpath(db_path)),
+        "created_at": int(time.time()),
+    }
+    header = json.dumps(manifest, indent=2).encode("utf-8")
+    padded = len(header) + (-(16 + len(header)) % ALIGNMENT)
+    header = header.ljust(padded, b" ")
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(vector_bytes)
+        f.write(record_bytes)
+    os.replace(tmp_path, out_path)
+    return manifest
+
+
+# -------- READ --------
+def read_manifest(path):
+    """Return (manifest, payload_offset) of a snapshot file"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an index snapshot")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        manifest = json.loads(f.read(header_len).decode("utf-8"))
+    return manifest, len(MAGIC) + 8 + header_len
+
+
+def verify_snapshot(path):
+    """Recompute the payload checksum; returns (ok, manifest)"""
+    manifest, payload_offset = read_manifest(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(payload_offset)
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest() == manifest["sha256"], manifest
+
+
+class SnapshotIndex(ChunkIndex):
+    """Memory-mapped snapshot with Chroma-style `query`, `get` and `count`"""
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest, payload_offset = read_manifest(path)
+        count, dim = self.manifest["count"], self.manifest["dim"]
+        self.vectors = np.memmap(
+            path,
+            dtype=np.dtype(self.manifest["dtype"]),
+            mode="r",
+            offset=payload_offset + self.manifest["vectors_offset"],
+            shape=(count, dim),
+        ) if count else np.zeros((0, dim), dtype=np.float32)
+
+        with open(path, "rb") as f:
+            f.seek(payload_offset + self.manifest["records_offset"])
+            super().__init__(json.loads(f.read(self.manifest["records_nbytes"]).decode("utf-8")))
+
+    def search(self, query, n_results=5, rows=None):
+        """Exact squared L2 search over the mapped vectors (only `rows`, if given)"""
+        query = np.asarray(query, dtype=np.float32)
+        total = len(self.ids) if rows is None else len(rows)
+        n_results = min(n_results, total)
+        if n_results == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        if rows is not None:
+            block = np.asarray(self.vectors[rows], dtype=np.float32) - query
+            distances = np.einsum("ij,ij->i", block, block)
+        else:
+            distances = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+                block = np.asarray(self.vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32) - query
+                distances[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+
+        positions = np.argpartition(distances, n_results - 1)[:n_results]
+        positions = positions[np.argsort(distances[positions])]
+        return (positions if rows is None else rows[positions]), distances[positions]
+
+
+_loaded = {}
+
+def load_snapshot_index(db_dir):
+    """Cached SnapshotIndex for an imported DB version, or None if it has no snapshot"""
+    path = os.path.join(db_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return None
+    stamp = os.path.getmtime(path)
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, SnapshotIndex(path))
+        _loaded[path] = cached
+    return cached[1]
+
+
+def snapshot_count(db_dir):
+    """Chunks in an imported DB version's snapshot, or None if it has none"""
+    path = os.path.join(db_dir, SNAPSHOT_FILE)
+    return read_manifest(path)[0]["count"] if os.path.exists(path) else None
+
+
+def materialize_snapshot(db_dir, build_dir):
+    """Write an imported version's snapshot into a Chroma collection in `build_dir`
+
+    Incremental builds add chunks to Chroma, so a version imported from a
+    snapshot is expanded back into a collection before new books go in.
+    """
+    index = SnapshotIndex(os.path.join(db_dir, SNAPSHOT_FILE))
+    model_name = index.manifest.get("embedding_model")
+    collection = chromadb.PersistentClient(path=build_dir).get_or_create_collection(
+        name=index.manifest["collection"],
+        metadata=model_metadata(model_name) if model_name else None,
+    )
+    for start in range(0, index.count(), EXPORT_BATCH_SIZE):
+        end = start + EXPORT_BATCH_SIZE
+        collection.add(
+            ids=index.ids[start:end],
+            embeddings=np.asarray(index.vectors[start:end], dtype=np.float32).tolist(),
+            documents=index.documents[start:end],
+            metadatas=[m or None for m in index.metadatas[start:end]],
+        )
+    return index.count()
+
+
+# -------- IMPORT --------
+def import_snapshot(snapshot_path, db_path):
+    """Verify a snapshot and publish it as a new version of a subject DB"""
+    ok, manifest = verify_snapshot(snapshot_path)
+    if not ok:
+        print(f"❌ Checksum mismatch, refusing to import {snapshot_path}")
+        return False
+
+    version_id, build_dir = create_build_dir(db_path, fresh=True)
+    shutil.copyfile(snapshot_path, os.path.join(build_dir, SNAPSHOT_FILE))
+
+    # Smoke query: a stored vector must find itself
+    index = SnapshotIndex(os.path.join(build_dir, SNAPSHOT_FILE))
+    if index.count() == 0 or index.search(index.vectors[0], 1)[1][0] > 1e-3:
+        del index
+        discard_version(db_path, version_id)
+        print("❌ Snapshot failed the smoke query")
+        return False
+    write_metadata_index(build_dir, index, manifest["collection"])
+    del index
+
+    publish_version(db_path, version_id)
+    collect_garbage(db_path)
+    print(f"✅ Imported {manifest['count']} chunks ({manifest['embedding_model']}) as version {version_id}")
+    return True
+
+
+# -------- COLD START --------
+def measure_cold_start(snapshot_path, query, chroma_db_path=None):
+    """Time each stage from process start to retrieved context for the first question"""
+    timings = {}
+    start = time.perf_counter()
+
+    index = SnapshotIndex(snapshot_path)
+    timings["open snapshot (mmap + records)"] = time.perf_counter() - start
+
+    from sentence_transformers import SentenceTransformer
+    t = time.perf_counter()
+    model = SentenceTransformer(index.manifest["embedding_model"])
+    timings["load embedding model"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    embedding = model.encode([query]).tolist()[0]
+    timings["embed first query"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    result = index.query([embedding], n_results=5)
+    timings["first retrieval (snapshot)"] = time.perf_counter() - t
+
+    if chroma_db_path:
+        t = time.perf_counter()
+        collection = open_published_collection(chroma_db_path, index.manifest["collection"])
+        collection.query(query_embeddings=[embedding], n_results=5)
+        timings["first retrieval (Chroma, for comparison)"] = time.perf_counter() - t
+
+    print(f"📊 Cold start for {snapshot_path} ({index.count()} chunks)")
+    for stage, seconds in timings.items():
+        print(f"   {stage:42s} {seconds * 1000:9.1f} ms")
+    total = sum(v for k, v in timings.items() if "Chroma" not in k)
+    print(f"   {'total to first context (LLM call excluded)':42s} {total * 1000:9.1f} ms")
+    print(f"   top hit: {result['documents'][0][0][:80] if result['documents'][0] else '-'}")
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    usage = (
+        "Usage:\n"
+        "  python index_snapshot.py export <db_path> <collection_name> <out.tsnap> [--fp16] [--model NAME]\n"
+        "  python index_snapshot.py import <snapshot.tsnap> <db_path>\n"
+        "  python index_snapshot.py verify <snapshot.tsnap>\n"
+        "  python index_snapshot.py coldstart <snapshot.tsnap> <question> [chroma_db_path]"
+    )
+    args = sys.argv[1:]
+    if not args:
+        print(usage)
+        sys.exit(1)
+
+    command = args[0]
+    if command == "export" and len(args) >= 4:
+        model = args[args.index("--model") + 1] if "--model" in args else None
+        manifest = export_snapshot(args[1], args[2], args[3], model_name=model, fp16="--fp16" in args)
+        size = os.path.getsize(args[3]) / 1e6
+        print(f"✅ Exported {manifest['count']} chunks ({manifest['dtype']}, {manifest['embedding_model']}) "
+              f"to {args[3]} ({size:.1f} MB)")
+    elif command == "import" and len(args) >= 3:
+        sys.exit(0 if import_snapshot(args[1], args[2]) else 1)
+    elif command == "verify" and len(args) >= 2:
+        ok, manifest = verify_snapshot(args[1])
+        print(f"{'✅ Checksum OK' if ok else '❌ Checksum mismatch'}: {json.dumps(manifest, indent=2)}")
+    elif command == "coldstart" and len(args) >= 3:
+        measure_cold_start(args[1], args[2], args[3] if len(args) > 3 else None)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,214 @@
+# metadata_index.py - Precomputed chapter/page index of a subject DB version
+# Built once per published version (db_versions.finish_build, snapshot import)
+# and saved next to the data, so listing chapters, building chapter/page
+# pre-filters, finding a chunk's neighbours and checking that FAQ entries
+# still match their chapter never scans the collection.
+#
+# metadata_index.json:
+#   {"collection": ..., "fields": [...metadata keys...],
+#    "chapters": [{"chapter", "pdf_file", "pages": [first, last] | null,
+#                  "chunks", "where", "chunk_ids": [...in reading order...],
+#                  "fingerprint": sha256 of the chapter text}]}
+import hashlib
+import json
+import os
+import re
+import sys
+
+# -------- CONFIG --------
+METADATA_INDEX_FILE = "metadata_index.json"
+READ_BATCH_SIZE = 5000
+NEIGHBOUR_WINDOW = 1        # chunks added on each side of a retrieved chunk
+
+_loaded = {}
+
+
+# -------- BUILD --------
+def read_chunks(collection):
+    """(ids, documents, metadatas) of every chunk in a Chroma collection or compact/snapshot index"""
+    if hasattr(collection, "metadatas") and hasattr(collection, "ids"):
+        return list(collection.ids), list(collection.documents), [m or {} for m in collection.metadatas]
+    ids, documents, metadatas = [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=READ_BATCH_SIZE, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(m or {} for m in batch["metadatas"])
+        offset += len(batch["ids"])
+    return ids, documents, metadatas
+
+
+def chapter_of(metadata):
+    """English chunks carry a chapter name; Gujarati chunks only their PDF"""
+    if metadata.get("chapter"):
+        return str(metadata["chapter"])
+    return os.path.splitext(str(metadata.get("pdf_file", "unknown")))[0]
+
+
+def reading_order(chunk_id, metadata):
+    """Sort key placing a chunk where it appears in its chapter"""
+    if "chunk_index" in metadata:
+        index = metadata["chunk_index"]
+    else:
+        # DBs built before chunk_index was stored: ids end in the chunk number
+        match = re.search(r"(\d+)$", chunk_id)
+        index = int(match.group(1)) if match else 0
+    return metadata.get("page", 0), index
+
+
+def group_by_chapter(ids, documents, metadatas):
+    """{chapter: [(chunk_id, document, metadata), ...] in reading order}"""
+    by_chapter = {}
+    for chunk_id, doc, meta in zip(ids, documents, metadatas):
+        by_chapter.setdefault(chapter_of(meta), []).append((reading_order(chunk_id, meta), chunk_id, doc, meta))
+    return {
+        chapter: [chunk[1:] for chunk in sorted(chunks, key=lambda item: item[0])]
+        for chapter, chunks in sorted(by_chapter.items())
+    }
+
+
+def chapter_fingerprint(documents):
+    """Hash of a chapter's text in reading order, used to detect re-ingested chapters"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update((doc or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def build_metadata_index(collection, collection_name):
+    """Chapter listing, filters, reading order and fingerprints for one collection"""
+    ids, documents, metadatas = read_chunks(collection)
+    fields = sorted({key for meta in metadatas for key in meta})
+
+    chapters = []
+    for chapter, chunks in group_by_chapter(ids, documents, metadatas).items():
+        pages = [meta[key] for _, _, meta in chunks for key in ("page", "page_end") if key in meta]
+        pdf_file = chunks[0][2].get("pdf_file")
+        chapters.append({
+            "chapter": chapter,
+            "pdf_file": pdf_file,
+            "pages": [min(pages), max(pages)] if pages else None,
+            "chunks": len(chunks),
+            "where": {"chapter": chapter} if "chapter" in fields else {"pdf_file": pdf_file},
+            "chunk_ids": [chunk_id for chunk_id, _, _ in chunks],
+            "fingerprint": chapter_fingerprint(doc for _, doc, _ in chunks),
+        })
+    return {"collection": collection_name, "fields": fields, "chapters": chapters}
+
+
+def write_metadata_index(db_dir, collection, collection_name):
+    """Build and save the metadata index inside a (version) directory"""
+    index = build_metadata_index(collection, collection_name)
+    path = os.path.join(db_dir, METADATA_INDEX_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return index
+
+
+# -------- LOOKUP --------
+class MetadataIndex:
+    """Chapter listing, pre-filters and neighbour lookup from a saved index"""
+
+    def __init__(self, data):
+        self.fields = set(data["fields"])
+        self.chapters = {c["chapter"]: c for c in data["chapters"]}
+        self.positions = {
+            chunk_id: (c["chapter"], position)
+            for c in data["chapters"]
+            for position, chunk_id in enumerate(c["chunk_ids"])
+        }
+        # Indexes written before fingerprints were stored match no FAQ entry
+        self.fingerprints = {c["chapter"]: c.get("fingerprint") for c in data["chapters"]}
+
+    def listing(self):
+        return [
+            {"chapter": c["chapter"], "pdf_file": c["pdf_file"], "pages": c["pages"], "chunks": c["chunks"]}
+            for c in self.chapters.values()
+        ]
+
+    def supports_pages(self):
+        return "page" in self.fields
+
+    def where(self, chapter=None, page=None):
+        """Chroma `where` filter for a chapter and/or page, or None for the whole DB
+
+        Raises KeyError for an unknown chapter.
+        """
+        conditions = []
+        if chapter:
+            conditions.append(self.chapters[chapter]["where"])
+        if page is not None and self.supports_pages():
+            if "page_end" in self.fields:
+                # English chunks can span pages: [page, page_end]
+                conditions.append({"page": {"$lte": page}})
+                conditions.append({"page_end": {"$gte": page}})
+            else:
+                conditions.append({"page": page})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def neighbours(self, chunk_ids, window=NEIGHBOUR_WINDOW):
+        """Each chunk surrounded by its neighbours in reading order, without duplicates"""
+        expanded = []
+        for chunk_id in chunk_ids:
+            if chunk_id not in self.positions:
+                candidates = [chunk_id]
+            else:
+                chapter, position = self.positions[chunk_id]
+                ordered = self.chapters[chapter]["chunk_ids"]
+                candidates = ordered[max(0, position - window):position + window + 1]
+            expanded.extend(c for c in candidates if c not in expanded)
+        return expanded
+
+
+def load_metadata_index(db_dir, collection=None, collection_name=None):
+    """Cached MetadataIndex of a version directory
+
+    Versions published before the index existed get it built from
+    `collection` on first use (and saved), or None if none was given.
+    """
+    path = os.path.join(db_dir, METADATA_INDEX_FILE)
+    if not os.path.exists(path):
+        if path in _loaded:
+            # Built in memory earlier because the version directory is read-only
+            return _loaded[path][1]
+        if collection is None:
+            return None
+        try:
+            write_metadata_index(db_dir, collection, collection_name)
+        except OSError:
+            _loaded[path] = (None, MetadataIndex(build_metadata_index(collection, collection_name)))
+            return _loaded[path][1]
+
+    stamp = os.path.getmtime(path)
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, encoding="utf-8") as f:
+            cached = (stamp, MetadataIndex(json.load(f)))
+        _loaded[path] = cached
+    return cached[1]
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Usage: python metadata_index.py <db_path> <collection_name>
+    if len(sys.argv) < 3:
+        print("Usage: python metadata_index.py <db_path> <collection_name>")
+        sys.exit(1)
+
+    from db_versions import open_published_collection, resolve_db_path
+
+    db_dir = resolve_db_path(sys.argv[1])
+    collection = open_published_collection(sys.argv[1], sys.argv[2])
+    index = write_metadata_index(db_dir, collection, sys.argv[2])
+    print(f"✅ Indexed {len(index['chapters'])} chapters ({', '.join(index['fields'])})")
+    for c in index["chapters"]:
+        pages = f"pages {c['pages'][0]}-{c['pages'][1]}" if c["pages"] else "no page metadata"
+        print(f"   {c['chapter']}: {c['chunks']} chunks, {pages}")
@@ -298,8 +298,11 @@ export default function App() {
   const [selectedAvatar, setSelectedAvatar] = useState(null);
   const [isSpeaking, setIsSpeaking] = useState(false);
   const [showAvatarSelection, setShowAvatarSelection] = useState(true);
+  const [sessionId, setSessionId] = useState("");
   const recognitionRef = useRef(null);
   const synthesisRef = useRef(null);
+  const audioRef = useRef(null);
+  const speechIdRef = useRef(0);
 
   useEffect(() => {
     if ('webkitSpeechRecognition' in window || 'SpeechRecognition' in window) {
@@ -336,9 +339,17 @@ export default function App() {
       if (synthesisRef.current) {
         synthesisRef.current.cancel();
       }
+      if (audioRef.current) {
+        audioRef.current.pause();
+      }
     };
   }, []);
 
+  useEffect(() => {
+    // New grade/subject means a new conversation on the backend
+    setSessionId("");
+  }, [grade, subject, medium]);
+
   useEffect(() => {
     if (medium === "gujarati") {
       setLanguage("gu-IN");
@@ -359,13 +370,81 @@ export default function App() {
       setStatusMessage("");
     } else {
       recognitionRef.current.lang = language;
+      warmUpSubject();
       recognitionRef.current.start();
       setIsListening(true);
       setStatusMessage("Listening...");
     }
   };
 
-  const speakText = (text) => {
+  const speakText = async (text) => {
+    // Server-side TTS streams one audio clip per sentence, so the avatar
+    // starts talking on the first sentence; browser voices are the fallback.
+    const speechId = ++speechIdRef.current;
+    if (audioRef.current) audioRef.current.pause();
+    if (synthesisRef.current) synthesisRef.current.cancel();
+
+    const formData = new FormData();
+    formData.append("text", text);
+    formData.append("language", language);
+    formData.append("gender", selectedAvatar || "female");
+
+    const queue = [];
+    let received = 0;
+    let playing = false;
+    let finished = false;
+
+    const playNext = () => {
+      if (speechIdRef.current !== speechId) return;
+      const next = queue.shift();
+      if (!next) {
+        playing = false;
+        if (finished) setIsSpeaking(false);
+        return;
+      }
+      playing = true;
+      const audio = new Audio(`http://127.0.0.1:8000${next.audio_url}`);
+      audioRef.current = audio;
+      audio.onended = playNext;
+      audio.onerror = playNext;
+      setIsSpeaking(true);
+      audio.play().catch(playNext);
+    };
+
+    try {
+      const res = await fetch("http://127.0.0.1:8000/tts", {
+        method: "POST",
+        body: formData,
+      });
+      if (!res.ok || !res.body) throw new Error(`TTS request failed: ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          queue.push(JSON.parse(line));
+          received += 1;
+          if (!playing) playNext();
+        }
+      }
+      finished = true;
+      if (!playing && speechIdRef.current === speechId) setIsSpeaking(false);
+    } catch (error) {
+      if (received === 0 && speechIdRef.current === speechId) {
+        console.error("Server TTS unavailable, using browser voice:", error);
+        speakWithBrowser(text);
+      }
+    }
+  };
+
+  const speakWithBrowser = (text) => {
     if (!synthesisRef.current) {
       console.error("Speech synthesis not supported");
       return;
@@ -427,6 +506,19 @@ export default function App() {
     synthesisRef.current.speak(utterance);
   };
 
+  // While the child speaks, let the backend load the subject DB (failures ignored)
+  const warmUpSubject = async () => {
+    if (!grade || !subject) return;
+    const formData = new FormData();
+    formData.append("grade", grade);
+    formData.append("subject", medium === "gujarati" ? `gujarati_${subject}` : subject);
+    try {
+      await fetch("http://127.0.0.1:8000/prefetch", { method: "POST", body: formData });
+    } catch (error) {
+      console.warn("Prefetch failed:", error);
+    }
+  };
+
   const handleSend = async () => {
     if (!input.trim()) return;
     
@@ -435,18 +527,35 @@ export default function App() {
     formData.append("grade", grade);
     const subjectToSend = medium === "gujarati" ? `gujarati_${subject}` : subject;
     formData.append("subject", subjectToSend);
+    // The first question asks the backend to start a conversation session
+    if (sessionId) formData.append("session_id", sessionId);
+    else formData.append("new_session", "true");
     if (file) formData.append("file", file);
 
     const userMessage = input;
     setInput("");
 
     try {
-      const res = await fetch("http://127.0.0.1:8000/ask", {
-        method: "POST",
-        body: formData,
-      });
+      let res;
+      for (let attempt = 0; ; attempt++) {
+        res = await fetch("http://127.0.0.1:8000/ask", {
+          method: "POST",
+          body: formData,
+        });
+        if (res.status !== 429 || attempt >= 2) break;
+
+        // Server is busy with a classroom burst: wait as long as it asks, then retry
+        const waitSeconds = Number(res.headers.get("Retry-After")) || 2;
+        setStatusMessage(medium === "gujarati"
+          ? `ઘણા પ્રશ્નો આવ્યા છે, ${waitSeconds} સેકન્ડમાં ફરી પ્રયાસ...`
+          : `Many questions right now, retrying in ${waitSeconds}s...`);
+        await new Promise(resolve => setTimeout(resolve, waitSeconds * 1000));
+      }
+      setStatusMessage("");
+      if (!res.ok) throw new Error(`Ask request failed: ${res.status}`);
 
       const data = await res.json();
+      if (data.session_id) setSessionId(data.session_id);
       setMessages(prev => [
         ...prev, 
         { role: "user", text: userMessage }, 
@@ -456,6 +565,7 @@ export default function App() {
       speakText(data.answer);
     } catch (error) {
       console.error("Error:", error);
+      setStatusMessage("");
       const errorMsg = medium === "gujarati" 
         ? "માફ કરશો, કોઈ ભૂલ થઈ. કૃપા કરીને ફરી પ્રયાસ કરો." 
         : "Sorry, I encountered an error. Please try again.";
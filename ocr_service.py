@@ -0,0 +1,181 @@
+# ocr_service.py - Shared OCR layer with warm Tesseract instances per language
+# Uses tesserocr (Tesseract C API) when installed, so traineddata is loaded once
+# per worker and images are passed as in-memory buffers. Falls back to
+# pytesseract otherwise: one subprocess per image, or for ocr_images one
+# subprocess per batch of pages (Tesseract reads them from a list file and
+# loads traineddata once).
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# -------- CONFIG --------
+MAX_OCR_WORKERS = os.cpu_count() or 2   # concurrent OCR calls across all languages
+
+# Tesseract install shared by both backends: pytesseract runs this binary and
+# tesserocr loads traineddata from its tessdata folder. Ignored where it does
+# not exist (Linux/macOS: the tesseract on PATH and the default tessdata).
+TESSERACT_CMD = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+if os.path.exists(TESSERACT_CMD):
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    TESSDATA_PATH = os.path.join(os.path.dirname(TESSERACT_CMD), "tessdata")
+else:
+    TESSDATA_PATH = None
+
+PAGE_SEPARATOR = "\f"    # Tesseract's default between the pages of a list file
+
+_slots = threading.BoundedSemaphore(MAX_OCR_WORKERS)
+_pools = {}         # (lang, psm, oem) -> idle PyTessBaseAPI instances
+_created = {}       # (lang, psm, oem) -> instances created so far
+_pools_lock = threading.Lock()
+
+
+# -------- WARM INSTANCES --------
+def _acquire(key):
+    """Take an idle instance for (lang, psm, oem), creating one if under the limit"""
+    with _pools_lock:
+        pool = _pools.setdefault(key, queue.LifoQueue())
+        try:
+            return pool, pool.get_nowait()
+        except queue.Empty:
+            pass
+        if _created.get(key, 0) < MAX_OCR_WORKERS:
+            _created[key] = _created.get(key, 0) + 1
+            create = True
+        else:
+            create = False
+
+    if create:
+        lang, psm, oem = key
+        kwargs = {"lang": lang, "psm": psm, "oem": oem}
+        if TESSDATA_PATH:
+            kwargs["path"] = TESSDATA_PATH
+        try:
+            return pool, tesserocr.PyTessBaseAPI(**kwargs)
+        except Exception:
+            with _pools_lock:
+                _created[key] -= 1
+            raise
+    return pool, pool.get()
+
+
+def _recognize_tesserocr(image, lang, psm, oem):
+    pool, api = _acquire((lang, psm, oem))
+    try:
+        if image.mode == "L":
+            # Hand Tesseract the raw grayscale buffer, no re-encoding
+            width, height = image.size
+            api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        else:
+            api.SetImage(image)
+        return api.GetUTF8Text()
+    finally:
+        pool.put(api)
+
+
+def _recognize_list(images, lang, psm, oem):
+    """OCR several images in one Tesseract process; returns one text per image"""
+    with tempfile.TemporaryDirectory(prefix="ocr_batch_") as tmp:
+        paths = []
+        for index, image in enumerate(images):
+            path = os.path.join(tmp, f"page_{index:05d}.png")
+            image.save(path, compress_level=1)
+            paths.append(path)
+        list_path = os.path.join(tmp, "pages.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(paths) + "\n")
+        text = pytesseract.image_to_string(list_path, lang=lang, config=f"--oem {oem} --psm {psm}")
+    pages = text.split(PAGE_SEPARATOR)
+    return (pages + [""] * len(images))[:len(images)]
+
+
+# -------- PUBLIC API --------
+def ocr_image(image, lang="guj+eng", psm=3, oem=3):
+    """OCR a PIL image or uint8 array; at most MAX_OCR_WORKERS run at once"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    with _slots:
+        if tesserocr is not None:
+            return _recognize_tesserocr(image, lang, psm, oem)
+        return pytesseract.image_to_string(image, lang=lang, config=f"--oem {oem} --psm {psm}")
+
+
+def ocr_images(images, lang="guj+eng", psm=3, oem=3):
+    """OCR a batch of pages, keeping Tesseract loaded across them even without tesserocr"""
+    images = [Image.fromarray(image) if isinstance(image, np.ndarray) else image for image in images]
+    if tesserocr is not None:
+        return [ocr_image(image, lang, psm, oem) for image in images]
+    if not images:
+        return []
+    with _slots:
+        return _recognize_list(images, lang, psm, oem)
+
+
+def backend_name():
+    if tesserocr is not None:
+        return "tesserocr (warm instances)"
+    return "pytesseract (subprocess per image, per batch with ocr_images)"
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Benchmark: per-page latency of the subprocess path vs warm instances
+    # Usage: python ocr_service.py <folder of page images> [lang]
+    from concurrent.futures import ThreadPoolExecutor
+
+    if len(sys.argv) < 2:
+        print("Usage: python ocr_service.py <folder of page images> [lang]")
+        sys.exit(1)
+
+    folder = sys.argv[1]
+    lang = sys.argv[2] if len(sys.argv) > 2 else "guj"
+    images = [
+        Image.open(os.path.join(folder, name)).convert("L")
+        for name in sorted(os.listdir(folder))
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"))
+    ]
+    if not images:
+        print("❌ No page images found")
+        sys.exit(1)
+
+    def report(label, latencies, wall):
+        latencies = sorted(latencies)
+        print(f"   {label:28s}: p50 {latencies[len(latencies) // 2] * 1000:.0f} ms | "
+              f"max {latencies[-1] * 1000:.0f} ms | {len(latencies) / wall:.2f} pages/s")
+
+    def timed(fn, image):
+        start = time.perf_counter()
+        fn(image)
+        return time.perf_counter() - start
+
+    print(f"📊 {len(images)} pages, lang={lang}, pool backend: {backend_name()}")
+
+    subprocess_ocr = lambda img: pytesseract.image_to_string(img, config=f"--oem 3 --psm 6 -l {lang}")
+    pooled_ocr = lambda img: ocr_image(img, lang=lang, psm=6)
+
+    start = time.perf_counter()
+    latencies = [timed(subprocess_ocr, img) for img in images]
+    report("subprocess, sequential", latencies, time.perf_counter() - start)
+
+    # Warm up one instance so the pooled numbers exclude the first traineddata load
+    pooled_ocr(images[0])
+    start = time.perf_counter()
+    latencies = [timed(pooled_ocr, img) for img in images]
+    report("pooled, sequential", latencies, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=MAX_OCR_WORKERS) as executor:
+        latencies = list(executor.map(lambda img: timed(pooled_ocr, img), images))
+    report(f"pooled, {MAX_OCR_WORKERS} concurrent", latencies, time.perf_counter() - start)
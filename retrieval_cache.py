@@ -0,0 +1,93 @@
+# retrieval_cache.py - Memoised textbook retrieval with DB-version invalidation
+# Caches the chunk IDs and distances returned for a normalised query, so repeat
+# questions skip the embedding and the vector search. Every writer of a subject
+# DB calls bump_db_version(), which changes the key and retires old entries.
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from db_versions import resolve_db_path
+
+# -------- CONFIG --------
+DB_VERSION_FILE = ".db_version"
+MAX_CACHE_ENTRIES = 4096
+
+
+# -------- DB VERSION STAMP --------
+def bump_db_version(db_path):
+    """Record that a subject DB changed (call after every write to it)"""
+    os.makedirs(db_path, exist_ok=True)
+    path = os.path.join(db_path, DB_VERSION_FILE)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"{time.time_ns()}-{uuid.uuid4().hex[:8]}")
+    os.replace(tmp_path, path)
+
+
+def db_version(db_path):
+    """Version stamp of a subject DB: bumped token, published version and Chroma file mtime"""
+    token = "0"
+    try:
+        with open(os.path.join(db_path, DB_VERSION_FILE), encoding="utf-8") as f:
+            token = f.read().strip()
+    except OSError:
+        pass
+    physical_path = resolve_db_path(db_path)
+    try:
+        # Also catches writers that predate bump_db_version
+        mtime = os.stat(os.path.join(physical_path, "chroma.sqlite3")).st_mtime_ns
+    except OSError:
+        mtime = 0
+    return f"{token}:{physical_path}:{mtime}"
+
+
+# -------- QUERY NORMALISATION --------
+def normalize_query(text):
+    """Lowercase, drop punctuation (keeping Gujarati) and collapse whitespace"""
+    text = re.sub(r'[^\u0A80-\u0AFF\w\s]', " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# -------- CACHE --------
+class RetrievalCache:
+    """Thread-safe LRU of query -> [(chunk_id, distance), ...]"""
+
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, db_path, query, n_results, extra=None):
+        return (db_path, db_version(db_path), normalize_query(query), n_results, extra)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, chunk_ids, distances):
+        with self._lock:
+            self._entries[key] = list(zip(chunk_ids, distances))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,265 @@
+# retrieval_controller.py - Per-DB calibrated retrieval depth and confidence gate
+# Instead of a fixed k and a hardcoded distance cut-off, each subject DB version
+# is calibrated from its own vectors:
+#   - sentences held out from sampled chunks are embedded as questions; how far
+#     they land from their nearest *other* chunk tells what an answerable
+#     question looks like. A query whose best hit is farther than almost all of
+#     them is answered with the guardrail message without calling the LLM
+#     (check a DB's false-skip rate on a labelled question set with --eval below)
+#   - the spread of each chunk's nearest neighbours tells when top results are
+#     unusually close together; only then is k widened
+import json
+import random
+import re
+import sys
+import threading
+
+import numpy as np
+
+from retrieval_cache import db_version
+
+# -------- CONFIG --------
+BASE_K = {"english": 3, "gujarati": 5}
+MAX_K_FACTOR = 2            # widened retrieval keeps at most 2x the base k
+CALIBRATION_SAMPLES = 256   # stored chunks sampled per DB version
+
+# Best hit farther than this percentile of held-out probe distances = low confidence
+PROBE_PERCENTILE = 98
+PROBE_MIN_WORDS = 4         # held-out sentences of question length
+PROBE_MAX_WORDS = 16
+
+# Answer low-confidence queries with the guardrail message instead of the LLM.
+# --eval fails a DB whose false-skip rate of answerable questions is above
+# MAX_FALSE_SKIP_RATE; raise PROBE_PERCENTILE (or turn this off) if one does:
+#   python retrieval_controller.py <db_path> english --eval eval/grade3_evs_questions.jsonl
+SKIP_UNRELATED_QUERIES = True
+MAX_FALSE_SKIP_RATE = 0.05
+
+# Top-k spread below this percentile of the DB's own neighbour spreads = "close together"
+TIE_PERCENTILE = 25
+
+# Hard ceilings kept from the original filters
+MAX_DISTANCE = {"gujarati": 1.5}
+
+
+# -------- CALIBRATION --------
+def sample_chunks(collection, n=CALIBRATION_SAMPLES):
+    """(ids, vectors, documents) of up to n stored chunks spread over the whole collection"""
+    if hasattr(collection, "vectors"):
+        # CompactIndex / SnapshotIndex keep their vectors memory-mapped
+        total = len(collection.vectors)
+        rows = np.unique(np.linspace(0, total - 1, min(n, total)).astype(int)) if total else []
+        return (
+            [collection.ids[r] for r in rows],
+            np.asarray(collection.vectors[rows], dtype=np.float32),
+            [collection.documents[r] for r in rows],
+        )
+
+    all_ids = collection.get(include=[])["ids"]
+    if not all_ids:
+        return [], np.zeros((0, 0), dtype=np.float32), []
+    sample_ids = random.Random(0).sample(all_ids, min(n, len(all_ids)))
+    data = collection.get(ids=sample_ids, include=["embeddings", "documents"])
+    return data["ids"], np.asarray(data["embeddings"], dtype=np.float32), data["documents"]
+
+
+def held_out_sentence(document, rng):
+    """A question-length sentence from a chunk, or None if it has none"""
+    sentences = re.split(r"(?<=[.!?।])\s+|\n+", document or "")
+    candidates = [s.strip() for s in sentences if PROBE_MIN_WORDS <= len(s.split()) <= PROBE_MAX_WORDS]
+    return rng.choice(candidates) if candidates else None
+
+
+def probe_distances(collection, ids, documents, embed):
+    """Best-hit distance of each held-out sentence, its own chunk excluded"""
+    rng = random.Random(0)
+    probes = [(chunk_id, held_out_sentence(doc, rng)) for chunk_id, doc in zip(ids, documents)]
+    probes = [(chunk_id, sentence) for chunk_id, sentence in probes if sentence]
+    if not probes:
+        return []
+    results = collection.query(
+        query_embeddings=embed([sentence for _, sentence in probes]),
+        n_results=2,
+        include=["distances"],
+    )
+    best = []
+    for (source, _), hit_ids, distances in zip(probes, results["ids"], results["distances"]):
+        others = [d for hit, d in zip(hit_ids, distances) if hit != source]
+        if others:
+            best.append(others[0])
+    return best
+
+
+def calibrate(collection, language, embed=None):
+    """Distance thresholds for one DB, or None if it is too small to calibrate
+
+    `embed(texts)` embeds questions for this DB; without it no low-confidence
+    threshold is set.
+    """
+    base_k = BASE_K[language]
+    ids, samples, documents = sample_chunks(collection)
+    if len(samples) < base_k + 2:
+        return None
+
+    probes = probe_distances(collection, ids, documents, embed) if embed else []
+    low_confidence = float(np.percentile(probes, PROBE_PERCENTILE)) if probes else None
+    if low_confidence is not None and language in MAX_DISTANCE:
+        low_confidence = min(low_confidence, MAX_DISTANCE[language])
+
+    # Spread between the 1st and k-th neighbour of each sampled chunk (itself excluded)
+    results = collection.query(
+        query_embeddings=samples.tolist(),
+        n_results=base_k + 1,
+        include=["distances"],
+    )
+    spreads = [d[base_k] - d[1] for d in results["distances"] if len(d) > base_k]
+    tie_spread = float(np.percentile(spreads, TIE_PERCENTILE)) if spreads else 0.0
+
+    return {
+        "low_confidence": low_confidence,
+        "tie_spread": tie_spread,
+        "samples": len(samples),
+        "probes": len(probes),
+    }
+
+
+def false_skip_rate(collection, calibration, questions, embed):
+    """(skipped, total) of answerable questions whose best hit is past the low-confidence threshold"""
+    if not questions or calibration is None or calibration["low_confidence"] is None:
+        return 0, len(questions)
+    results = collection.query(query_embeddings=embed(questions), n_results=1, include=["distances"])
+    skipped = sum(1 for d in results["distances"] if not d or d[0] >= calibration["low_confidence"])
+    return skipped, len(questions)
+
+
+# -------- CONTROLLER --------
+class RetrievalController:
+    """Chooses how many chunks to keep per query and when to skip the LLM"""
+
+    def __init__(self):
+        self._calibrations = {}   # db_path -> (db_version, calibration)
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.widened = 0
+        self.low_confidence = 0
+        self.llm_calls_saved = 0
+
+    def fetch_k(self, language):
+        """Results to request from the vector search (the widest k ever kept)"""
+        return BASE_K[language] * MAX_K_FACTOR
+
+    def calibration(self, db_path, collection, language, embed=None):
+        """Cached calibration for the published version of a subject DB
+
+        `embed(texts)` embeds questions with the DB's query model (see calibrate).
+        """
+        version = db_version(db_path)
+        with self._lock:
+            cached = self._calibrations.get(db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        try:
+            calibration = calibrate(collection, language, embed)
+        except Exception as e:
+            print(f"Calibration failed for {db_path}: {e}")
+            calibration = None
+        if calibration:
+            low = calibration["low_confidence"]
+            print(f"Calibrated {db_path}: low confidence >= {'-' if low is None else f'{low:.3f}'} "
+                  f"({calibration['probes']} probes), tie spread <= {calibration['tie_spread']:.3f}")
+        with self._lock:
+            self._calibrations[db_path] = (version, calibration)
+        return calibration
+
+    def select(self, calibration, distances, language):
+        """(number of results to keep, confident) for distances sorted ascending
+
+        Low-confidence queries are only counted, and still reported as
+        confident, unless SKIP_UNRELATED_QUERIES is on.
+        """
+        base_k = BASE_K[language]
+        with self._lock:
+            self.queries += 1
+        if not distances:
+            return 0, False
+        if calibration is None:
+            # Uncalibrated DB: fixed k, always let the LLM decide
+            return min(base_k, len(distances)), True
+
+        low_confidence = calibration["low_confidence"]
+        confident = low_confidence is None or bool(distances[0] < low_confidence)
+        if not confident:
+            with self._lock:
+                self.low_confidence += 1
+            confident = not SKIP_UNRELATED_QUERIES
+        keep = min(base_k, len(distances))
+        if len(distances) > base_k and distances[base_k - 1] - distances[0] <= calibration["tie_spread"]:
+            # Top results are nearly tied, so the answer is likely spread over more chunks
+            band = distances[0] + calibration["tie_spread"]
+            while keep < len(distances) and distances[keep] <= band:
+                keep += 1
+            if keep > base_k:
+                with self._lock:
+                    self.widened += 1
+        return keep, confident
+
+    def record_llm_call_saved(self):
+        with self._lock:
+            self.llm_calls_saved += 1
+
+    def stats(self):
+        with self._lock:
+            calibrations = {db_path: calibration for db_path, (_, calibration) in self._calibrations.items()}
+        return {
+            "queries": self.queries,
+            "widened": self.widened,
+            "low_confidence": self.low_confidence,
+            "skip_unrelated_queries": SKIP_UNRELATED_QUERIES,
+            "llm_calls_saved": self.llm_calls_saved,
+            "calibrated_dbs": calibrations,
+        }
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Usage: python retrieval_controller.py <db_path> <english|gujarati> [--eval questions.jsonl]
+    from sentence_transformers import SentenceTransformer
+
+    from db_versions import open_published_collection
+    from embedding_models import EMBEDDING_MODELS
+
+    if len(sys.argv) < 3:
+        print("Usage: python retrieval_controller.py <db_path> <english|gujarati> [--eval questions.jsonl]")
+        sys.exit(1)
+
+    db_path, language = sys.argv[1], sys.argv[2].lower()
+    collection_name = "gujarati_textbook_db" if language == "gujarati" else "textbook_db"
+    collection = open_published_collection(db_path, collection_name)
+    model = SentenceTransformer(EMBEDDING_MODELS[language])
+
+    def embed(texts):
+        return model.encode(texts).tolist()
+
+    calibration = calibrate(collection, language, embed)
+    if calibration is None:
+        print("❌ Not enough chunks to calibrate")
+        sys.exit(1)
+    print(f"📊 {db_path} ({calibration['samples']} sampled chunks, {calibration['probes']} held-out probes)")
+    if calibration["low_confidence"] is None:
+        print("   no question-length sentences to calibrate the low-confidence threshold on")
+    else:
+        print(f"   low confidence when best distance >= {calibration['low_confidence']:.3f}")
+    print(f"   widen k when top-{BASE_K[language]} spread <= {calibration['tie_spread']:.3f}")
+
+    if "--eval" in sys.argv:
+        # Every labelled question is answerable from the book, so each skip is a false skip
+        with open(sys.argv[sys.argv.index("--eval") + 1], encoding="utf-8") as f:
+            questions = [json.loads(line)["question"] for line in f if line.strip()]
+        skipped, total = false_skip_rate(collection, calibration, questions, embed)
+        print(f"   answerable questions skipped: {skipped}/{total} ({skipped / max(total, 1):.0%})"
+              f"{'' if SKIP_UNRELATED_QUERIES else ' (gate is off: SKIP_UNRELATED_QUERIES = False)'}")
+        if skipped > MAX_FALSE_SKIP_RATE * total:
+            print(f"❌ Above the {MAX_FALSE_SKIP_RATE:.0%} false-skip budget: raise PROBE_PERCENTILE "
+                  "or set SKIP_UNRELATED_QUERIES = False")
+            sys.exit(1)
@@ -0,0 +1,197 @@
+# session_store.py - Bounded server-side conversation sessions for /ask
+import math
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# -------- CONFIG --------
+MAX_SESSIONS = 1000          # LRU bound on live sessions
+SESSION_IDLE_TIMEOUT = 1800  # seconds without a question before a session expires
+MAX_TURNS = 4                # question/answer pairs kept per session
+
+# Cosine similarity above which a follow-up reuses the previous chunks as-is
+CONTEXT_REUSE_SIMILARITY = 0.9
+
+# A short question is a follow-up only if it points back at the previous turn
+# ("is it a mammal?", "tell me more", "what about lions?"); "why do birds fly?"
+# has its own content words and no such cue, so it stands alone.
+ANAPHORA_WORDS = {
+    "it", "its", "that", "this", "they", "them", "those", "these", "there", "he", "she", "him", "her",
+    "તે", "તેને", "તેનું", "તેની", "તેઓ", "એ", "એને", "એનું",
+}
+MORE_WORDS = {"more", "again", "else", "વધુ", "ફરીથી"}
+FOLLOW_UP_PATTERNS = [r"^what about\b", r"^how about\b", r"^and\b"]
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "do", "does", "did", "what", "why",
+    "how", "who", "when", "where", "which", "me", "tell", "more", "about", "it", "this",
+    "that", "they", "them", "and", "or", "of", "to", "in", "on", "for", "please", "can",
+    "you", "i", "explain", "again", "so",
+    "કેમ", "શા", "માટે", "શું", "સમજાવો", "કહો", "વધુ", "ફરીથી", "તે", "એ", "આ", "અને", "છે",
+}
+
+
+# -------- FOLLOW-UP HANDLING --------
+def words_of(text):
+    return re.findall(r'[\u0A80-\u0AFF]+|[a-zA-Z]+', text.lower())
+
+
+def content_words(text):
+    """Words that carry meaning for retrieval (Gujarati words always count)"""
+    return [w for w in words_of(text) if w not in STOPWORDS and (len(w) > 2 or re.match(r'[\u0A80-\u0AFF]', w))]
+
+
+def is_follow_up(message):
+    """Detect questions like "tell me more" or "why is it green?" that depend on the previous turn"""
+    text = message.strip().lower()
+    content = content_words(text)
+    if not content:
+        return True
+    if len(content) > 2:
+        return False
+    return (
+        any(w in ANAPHORA_WORDS or w in MORE_WORDS for w in words_of(text))
+        or any(re.search(p, text) for p in FOLLOW_UP_PATTERNS)
+    )
+
+
+def rewrite_follow_up(message, previous_question):
+    """Make a follow-up self-contained by anchoring it to the previous question"""
+    return f"{previous_question} {message.strip()}"
+
+
+def cosine_similarity(a, b):
+    """Cosine similarity of two plain-list embeddings"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+# -------- SESSIONS --------
+class Session:
+    """History and last retrieval of one conversation"""
+
+    def __init__(self, max_turns=MAX_TURNS):
+        self.history = deque(maxlen=max_turns)
+        self.grade = None
+        self.subject = None
+        self.last_chunks = []      # chunks retrieved for the last turn (not those it inherited)
+        self.last_retrieval = None # (query embedding, scope, chunks) of the last turn that embedded its query
+        self.topic = None          # last standalone question, which follow-ups are rewritten against
+        self.last_active = time.monotonic()
+
+    def bind(self, grade, subject):
+        """Forget cached context when the student switches grade or subject"""
+        if (grade, subject) != (self.grade, self.subject):
+            self.history.clear()
+            self.last_chunks = []
+            self.last_retrieval = None
+            self.topic = None
+            self.grade, self.subject = grade, subject
+
+    def reusable_chunks(self, query_embedding, scope=None):
+        """Previous chunks if the new query is close to the previous one and has the same chapter/page scope"""
+        if self.last_retrieval is None:
+            return None
+        last_embedding, last_scope, chunks = self.last_retrieval
+        if not chunks or scope != last_scope:
+            return None
+        if cosine_similarity(query_embedding, last_embedding) >= CONTEXT_REUSE_SIMILARITY:
+            return chunks
+        return None
+
+    def add_turn(self, question, answer, chunks, query_embedding, follow_up=False, scope=None):
+        """Record a turn as asked; standalone questions become the new topic
+
+        `chunks` are the ones retrieved (or reused) for this turn only. Turns
+        answered without embedding the query (retrieval cache hits) leave the
+        previous embedding and its chunks in place for reuse.
+        """
+        self.history.append({"question": question, "answer": answer})
+        if not follow_up:
+            self.topic = question
+        self.last_chunks = chunks
+        if query_embedding is not None:
+            self.last_retrieval = (query_embedding, scope, chunks)
+
+
+class SessionStore:
+    """Thread-safe LRU of sessions with idle expiry"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT, max_turns=MAX_TURNS):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire_idle(self, now):
+        # Oldest entries sit at the front, so stop at the first live one
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.idle_timeout:
+                break
+            del self._sessions[session_id]
+
+    def get_or_create(self, session_id=None):
+        """Return (session_id, session); unknown or expired IDs start a new session"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session_id = uuid.uuid4().hex
+                session = Session(self.max_turns)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_active = now
+            return session_id, session
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Simulate many concurrent students to check the store stays bounded
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    N_SESSIONS = 5000
+    TURNS_PER_SESSION = 10
+    store = SessionStore(max_sessions=500, idle_timeout=60)
+    questions = ["What is a plant?", "why?", "tell me more", "What do animals eat?", "how?"]
+
+    def simulate(_):
+        session_id = None
+        restarted = 0
+        for _ in range(TURNS_PER_SESSION):
+            new_id, session = store.get_or_create(session_id)
+            if session_id and new_id != session_id:
+                restarted += 1
+            session_id = new_id
+            session.bind("3", "evs")
+            question = random.choice(questions)
+            embedding = [random.random() for _ in range(8)]
+            follow_up = bool(session.history and is_follow_up(question))
+            if follow_up:
+                rewrite_follow_up(question, session.topic)
+            session.reusable_chunks(embedding)
+            session.add_turn(question, "answer", ["chunk"], embedding, follow_up)
+            assert len(session.history) <= store.max_turns
+        return restarted
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        restarts = sum(pool.map(simulate, range(N_SESSIONS)))
+    elapsed = time.perf_counter() - start
+
+    print(f"Simulated {N_SESSIONS} sessions x {TURNS_PER_SESSION} turns in {elapsed:.2f}s")
+    print(f"Live sessions: {len(store)} (bound {store.max_sessions})")
+    print(f"Sessions evicted mid-conversation: {restarts}")
+    assert len(store) <= store.max_sessions
@@ -0,0 +1,283 @@
+# tts_engine.py - Offline text-to-speech with a sentence-level audio cache
+# Uses pyttsx3 (SAPI5 on Windows, espeak-ng on Linux) so answers can be voiced
+# on the server instead of relying on the browser's speechSynthesis voices.
+# Without pyttsx3, or without an installed voice for the language, synthesis
+# raises VoiceUnavailable and the frontend falls back to browser voices.
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import pyttsx3
+except ImportError:
+    pyttsx3 = None
+
+# -------- CONFIG --------
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache")
+SPEECH_RATE = 150  # words per minute, a little slower for young children
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024   # least recently played audio is deleted past this
+TTS_CACHE_PRUNE_TO = 0.9                  # ...down to this fraction, so pruning is not per sentence
+
+LANGUAGE_NAMES = {
+    "en": "english",
+    "gu": "gujarati",
+    "hi": "hindi",
+}
+
+# pyttsx3 engines are bound to the thread that created them (COM apartment with
+# SAPI5) and runAndWait is not re-entrant, so one long-lived thread owns the
+# engine and runs all speech jobs from a queue
+_engine = None
+_jobs = queue.Queue()
+_engine_thread = None
+_engine_thread_lock = threading.Lock()
+_voice_ids = {}
+
+_cache_lock = threading.Lock()
+_cache_bytes = None   # size of TTS_CACHE_DIR, counted on first synthesis
+
+stats = {"hits": 0, "misses": 0, "synthesis_seconds": 0.0, "evicted": 0}
+_stats_lock = threading.Lock()
+
+
+class VoiceUnavailable(Exception):
+    """No TTS engine, or no installed voice for the requested language"""
+
+
+# -------- SENTENCES --------
+def split_sentences(text):
+    """Split an answer into sentences (handles '.', '!', '?' and the danda '।')"""
+    parts = re.split(r"(?<=[.!?।])\s+|\n+", text)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def audio_id_for(text, voice):
+    """Cache key for a sentence spoken with a given voice"""
+    return hashlib.sha256(f"{voice}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def audio_path(audio_id):
+    return os.path.join(TTS_CACHE_DIR, f"{audio_id}.wav")
+
+
+# -------- STATS --------
+def _count(key, amount=1):
+    with _stats_lock:
+        stats[key] += amount
+
+
+def stats_snapshot():
+    with _stats_lock:
+        return dict(stats)
+
+
+# -------- ENGINE --------
+def _engine_loop():
+    """Run queued (function, future) jobs on the engine's own thread"""
+    if os.name == "nt":
+        try:
+            import comtypes
+            comtypes.CoInitialize()
+        except ImportError:
+            pass
+    while True:
+        fn, future = _jobs.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            future.set_result(fn(_get_engine()))
+        except BaseException as e:
+            future.set_exception(e)
+
+
+def _on_engine(fn):
+    """Call fn(engine) on the engine thread and return its result"""
+    global _engine_thread
+    with _engine_thread_lock:
+        if _engine_thread is None:
+            _engine_thread = threading.Thread(target=_engine_loop, name="tts-engine", daemon=True)
+            _engine_thread.start()
+    future = Future()
+    _jobs.put((fn, future))
+    return future.result()
+
+
+def _get_engine():
+    """The engine, created on first use (only ever called on the engine thread)"""
+    global _engine
+    if _engine is None:
+        if pyttsx3 is None:
+            raise VoiceUnavailable("pyttsx3 is not installed")
+        try:
+            _engine = pyttsx3.init()
+        except Exception as e:   # no SAPI5 / espeak-ng driver on this machine
+            raise VoiceUnavailable(f"no speech driver: {e}")
+        _engine.setProperty("rate", SPEECH_RATE)
+    return _engine
+
+
+def _select_voice(engine, language, gender):
+    """Best installed voice for a language code like 'gu-IN' and an avatar gender"""
+    key = (language, gender)
+    if key in _voice_ids:
+        return _voice_ids[key]
+
+    prefix = language.split("-")[0].lower()
+    name = LANGUAGE_NAMES.get(prefix, prefix)
+    matches = []
+    for voice in engine.getProperty("voices"):
+        codes = [
+            (code.decode("utf-8", "ignore") if isinstance(code, bytes) else str(code)).strip("\x00\x05 ").lower()
+            for code in (voice.languages or [])
+        ]
+        label = f"{voice.id} {voice.name}".lower()
+        if any(code.startswith(prefix) for code in codes) or name in label:
+            matches.append(voice)
+
+    chosen = None
+    for voice in matches:
+        label = f"{voice.name} {getattr(voice, 'gender', '') or ''}".lower()
+        if (gender == "female") == ("female" in label):
+            chosen = voice
+            break
+    if chosen is None and matches:
+        chosen = matches[0]
+
+    _voice_ids[key] = chosen.id if chosen else None
+    return _voice_ids[key]
+
+
+def voice_for(language, gender):
+    """Installed voice id for a language and avatar gender; raises VoiceUnavailable if none"""
+    key = (language, gender)
+    voice_id = _voice_ids[key] if key in _voice_ids else _on_engine(lambda engine: _select_voice(engine, language, gender))
+    if voice_id is None:
+        # Another language's voice would read the text wrongly (and be cached)
+        raise VoiceUnavailable(f"no installed voice for {language}")
+    return voice_id
+
+
+# -------- CACHE --------
+def _add_to_cache(size):
+    """Account for a new audio file and delete the least recently played ones past the cap"""
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry.stat().st_size for entry in os.scandir(TTS_CACHE_DIR) if entry.is_file())
+        else:
+            _cache_bytes += size
+        if _cache_bytes <= TTS_CACHE_MAX_BYTES:
+            return
+
+        # Hits touch their file, so the oldest modification time is the least recently played
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(TTS_CACHE_DIR)
+            if entry.is_file() and entry.name.endswith(".wav") and ".tmp." not in entry.name
+        )
+        _cache_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if _cache_bytes <= TTS_CACHE_MAX_BYTES * TTS_CACHE_PRUNE_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue   # still being sent (Windows); retried on the next prune
+            _cache_bytes -= size
+            _count("evicted")
+
+
+# -------- SYNTHESIS --------
+def synthesize(text, language="en-IN", gender="female"):
+    """Return (audio_id, cached) for one sentence, synthesising it on a cache miss"""
+    # Keyed by the voice actually used, so installing a better voice re-synthesises
+    voice_id = voice_for(language, gender)
+    audio_id = audio_id_for(text, voice_id)
+    path = audio_path(audio_id)
+
+    if os.path.exists(path):
+        try:
+            os.utime(path)   # recently played: evicted last
+        except OSError:
+            pass
+        _count("hits")
+        return audio_id, True
+
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    start = time.perf_counter()
+
+    def speak(engine):
+        # Another request may have produced it while this job was queued
+        if os.path.exists(path):
+            return 0
+        engine.setProperty("voice", voice_id)
+        tmp_path = f"{path}.tmp.wav"
+        engine.save_to_file(text, tmp_path)
+        engine.runAndWait()
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    size = _on_engine(speak)
+    if not size:
+        _count("hits")
+        return audio_id, True
+    _add_to_cache(size)
+    _count("misses")
+    _count("synthesis_seconds", time.perf_counter() - start)
+    return audio_id, False
+
+
+def synthesize_sentences(text, language="en-IN", gender="female"):
+    """Yield one entry per sentence as soon as its audio is ready"""
+    for index, sentence in enumerate(split_sentences(text)):
+        audio_id, cached = synthesize(sentence, language, gender)
+        yield {"index": index, "text": sentence, "audio_id": audio_id, "cached": cached}
+
+
+# -------- MAIN --------
+if __name__ == "__main__":
+    # Benchmark: synthesis latency per sentence and cache hit rate on a repeat pass
+    samples = {
+        "en-IN": "Plants need water and sunlight to grow. Animals eat plants or other animals. "
+                 "The sun gives us light and heat! Why do we need air? We need air to breathe.",
+        "gu-IN": "છોડને ઉગવા માટે પાણી અને સૂર્યપ્રકાશ જોઈએ છે. પ્રાણીઓ છોડ ખાય છે. "
+                 "સૂર્ય આપણને પ્રકાશ અને ગરમી આપે છે.",
+    }
+
+    def run_pass(sentences, language):
+        with _stats_lock:
+            stats.update(hits=0, misses=0, synthesis_seconds=0.0)
+        latencies = []
+        for sentence in sentences:
+            start = time.perf_counter()
+            synthesize(sentence, language)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    for language, text in samples.items():
+        sentences = split_sentences(text)
+        try:
+            voice_id = voice_for(language, "female")
+        except VoiceUnavailable as e:
+            print(f"{language}: skipped ({e})")
+            continue
+        # Start cold: drop any cached audio for these sentences
+        for sentence in sentences:
+            path = audio_path(audio_id_for(sentence, voice_id))
+            if os.path.exists(path):
+                os.remove(path)
+
+        for run in ("cold", "warm"):
+            latencies = run_pass(sentences, language)
+            first = latencies[0]
+            latencies.sort()
+            total = stats["hits"] + stats["misses"]
+            print(f"{language} {run}: {len(latencies)} sentences | "
+                  f"first sentence {first * 1000:.1f} ms | "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms | "
+                  f"max {latencies[-1] * 1000:.1f} ms | "
+                  f"hit rate {stats['hits'] / total:.0%}")
@@ -2,9 +2,12 @@
 # pip install chromadb pymupdf sentence-transformers
 
 import os
+import re
 import fitz  # PyMuPDF
 from sentence_transformers import SentenceTransformer
 import chromadb
+from db_versions import create_build_dir, finish_build
+from embedding_models import EMBEDDING_MODELS, model_metadata
 
 # Step 1: Setup
 
@@ -13,11 +16,14 @@ PDF_FOLDER = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\textbooks\grade1\MATHS_jo
 DB_DIR = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\vector_db\grade1_maths_db"  # where the ChromaDB database will be saved
 
 # Initialize embedding model
-model = SentenceTransformer("multi-qa-MiniLM-L6-cos-v1")  # lightweight & fast
+MODEL_NAME = EMBEDDING_MODELS["english"]  # must match the model backend.py queries with
+model = SentenceTransformer(MODEL_NAME)  # lightweight & fast
 
-# Initialize ChromaDB (persistent so data is saved)
-client = chromadb.PersistentClient(path=DB_DIR)
-collection = client.get_or_create_collection(name="textbook_db")
+# Build into a fresh, unpublished version of the DB; the backend keeps
+# serving the current version until this one is validated and published
+version_id, build_dir = create_build_dir(DB_DIR, fresh=True)
+client = chromadb.PersistentClient(path=build_dir)
+collection = client.get_or_create_collection(name="textbook_db", metadata=model_metadata(MODEL_NAME))
 
 # Step 2: Text Chunking
 
@@ -32,6 +38,20 @@ def chunk_text(text, chunk_size=500, overlap=50):
     return chunks
 
 
+def chunk_pages(full_text, chunks, chunk_size=500, overlap=50):
+    """(first page, last page) each chunk covers, from the "Page N:" markers"""
+    markers = [(m.start(), int(m.group(1))) for m in re.finditer(r"Page (\d+):\n", full_text)]
+    spans = []
+    for i, chunk in enumerate(chunks):
+        start = i * (chunk_size - overlap)
+        end = start + len(chunk)
+        pages = [page for offset, page in markers if offset < end]
+        first = [page for offset, page in markers if offset <= start]
+        first_page = first[-1] if first else (pages[0] if pages else 0)
+        spans.append((first_page, pages[-1] if pages else first_page))
+    return spans
+
+
 # Step 3: Process PDFs
 
 def process_pdf(pdf_path, subject,grade, chapter_name):
@@ -46,6 +66,7 @@ def process_pdf(pdf_path, subject,grade, chapter_name):
 
     # Split into chunks
     chunks = chunk_text(full_text)
+    page_spans = chunk_pages(full_text, chunks)
 
     # Create embeddings
     embeddings = model.encode(chunks).tolist()
@@ -59,7 +80,10 @@ def process_pdf(pdf_path, subject,grade, chapter_name):
                 "subject": subject,
                 "grade": grade,
                 "chapter": chapter_name,
-                "pdf_file": os.path.basename(pdf_path)
+                "pdf_file": os.path.basename(pdf_path),
+                "page": page_spans[i][0],
+                "page_end": page_spans[i][1],
+                "chunk_index": i
             }],
             ids=[f"{chapter_name}_{i}"]
         )
@@ -75,4 +99,6 @@ for filename in os.listdir(PDF_FOLDER):
         pdf_path = os.path.join(PDF_FOLDER, filename)
         process_pdf(pdf_path, subject="Maths", grade=1,chapter_name=chapter_name)
 
-print("Vector database built successfully!")
+# Validate, atomically switch the backend to the new version, drop old versions
+if finish_build(DB_DIR, version_id, "textbook_db"):
+    print("Vector database built successfully!")
@@ -1,13 +1,18 @@
 # vectordb_guj_batch.py - Batch process multiple textbooks into separate databases
 import os
 from pdf2image import convert_from_path
-import pytesseract
 from sentence_transformers import SentenceTransformer
 import chromadb
 from PIL import Image
-import cv2
-import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from ocr_preprocess import preprocess_image
+from ocr_service import MAX_OCR_WORKERS, ocr_images
+from db_versions import (
+    collection_count, create_build_dir, discard_version, finish_build,
+    rebuild_requested, resolve_db_path,
+)
+from embedding_models import EMBEDDING_MODELS, check_model, record_model, stored_model
 
 # -------- CONFIG --------
 # Base directory for vector databases
@@ -15,7 +20,10 @@ VECTOR_DB_BASE_DIR = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\vector_db"
 TEXTBOOK_BASE_DIR = r"C:\Users\HP\Desktop\uni\seventh_sem\rms\textbooks\gujarati"
 
 POPPLER_PATH = r"C:\Program Files\poppler-25.07.0\Library\bin"
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# The Tesseract install (binary and tessdata) is configured in ocr_service.py
+
+# Pages handed to one OCR call; without tesserocr each batch is one Tesseract process
+OCR_BATCH_PAGES = 8
 
 # Define your textbooks to process
 TEXTBOOKS = [
@@ -38,18 +46,8 @@ TEXTBOOKS = [
 COLLECTION_NAME = "gujarati_textbook_db"
 
 # Initialize embedding model (shared across all processing)
-model = SentenceTransformer("intfloat/multilingual-e5-base")
-
-# -------- IMAGE PREPROCESSING --------
-def preprocess_image(pil_image):
-    """Enhance image quality for better OCR"""
-    img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(denoised)
-    _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    return Image.fromarray(binary)
+MODEL_NAME = EMBEDDING_MODELS["gujarati"]
+model = SentenceTransformer(MODEL_NAME)
 
 # -------- TEXT CHUNKING --------
 def chunk_text(text, chunk_size=400, overlap=50):
@@ -76,6 +74,47 @@ def get_database_path(grade, language, subject):
     
     return db_path
 
+# -------- VERSIONED BUILDS --------
+# Each subject DB gets one unpublished build per run; the backend keeps serving
+# the published version until publish_builds() validates and swaps it in.
+open_builds = {}
+
+def get_build_collection(db_path):
+    """Collection of this run's build for a subject DB (created on first use)"""
+    if db_path not in open_builds:
+        fresh = rebuild_requested(db_path)
+        # An incremental build must not lose chunks the published version has
+        previous = 0 if fresh else collection_count(resolve_db_path(db_path), COLLECTION_NAME)
+        version_id, build_dir = create_build_dir(db_path)
+        open_builds[db_path] = {
+            "version_id": version_id,
+            "build_dir": build_dir,
+            "min_count": max(1, previous),
+            "fresh": fresh,
+            "added": 0,
+        }
+        print(f"🏗️  New build {version_id} for {os.path.basename(db_path)}"
+              f" ({'empty' if fresh else 'copied from published version'})")
+    client = chromadb.PersistentClient(path=open_builds[db_path]["build_dir"])
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    ok, stored = check_model(collection, COLLECTION_NAME, MODEL_NAME)
+    if collection.count() and not ok:
+        # Adding chunks embedded with another model would make distances meaningless
+        raise SystemExit(f"❌ {os.path.basename(db_path)} was embedded with {stored}, not {MODEL_NAME}. "
+                         f"Re-embed it first: python embedding_models.py reembed {db_path} {COLLECTION_NAME} {MODEL_NAME}")
+    if stored_model(collection) is None:
+        record_model(collection, MODEL_NAME)
+    return collection
+
+def publish_builds():
+    """Validate every build of this run and publish the ones that changed"""
+    for db_path, build in open_builds.items():
+        if build["added"] == 0 and not build["fresh"]:
+            discard_version(db_path, build["version_id"])
+            print(f"⏭️  {os.path.basename(db_path)}: nothing new, keeping published version")
+            continue
+        finish_build(db_path, build["version_id"], COLLECTION_NAME, build["min_count"])
+
 # -------- CHECK IF FILE ALREADY PROCESSED --------
 def is_already_processed(collection, pdf_filename):
     """Check if this PDF has already been added to the database"""
@@ -93,9 +132,8 @@ def ocr_pdf(pdf_path, subject, grade, language, skip_if_exists=True):
     # Get the appropriate database path for this textbook
     db_path = get_database_path(grade, language, subject)
     
-    # Initialize ChromaDB client for this specific database
-    client = chromadb.PersistentClient(path=db_path)
-    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    # Write into this run's unpublished build of that database
+    collection = get_build_collection(db_path)
     
     # Check if already processed
     if skip_if_exists and is_already_processed(collection, pdf_filename):
@@ -114,9 +152,9 @@ def ocr_pdf(pdf_path, subject, grade, language, skip_if_exists=True):
     print(f"{'='*60}")
     
     try:
-        # Convert PDF to images
-        pages = convert_from_path(pdf_path, dpi=400, poppler_path=POPPLER_PATH)
-        print(f"✓ Converted {len(pages)} pages to images at 400 DPI")
+        # Convert PDF to grayscale images (no colour conversion needed for OCR)
+        pages = convert_from_path(pdf_path, dpi=400, poppler_path=POPPLER_PATH, grayscale=True)
+        print(f"✓ Converted {len(pages)} grayscale pages to images at 400 DPI")
     except Exception as e:
         print(f"❌ Error converting PDF: {e}")
         return 0, db_path
@@ -125,14 +163,23 @@ def ocr_pdf(pdf_path, subject, grade, language, skip_if_exists=True):
     all_embeddings = []
     all_metadata = []
     
-    for page_num, page in enumerate(pages, start=1):
+    # Preprocess + OCR batches of pages in parallel on the shared warm Tesseract
+    # workers; the workers already use every core, so pages are denoised untiled
+    def ocr_batch(batch):
+        return ocr_images([preprocess_image(page, tiled=False) for page in batch], lang="guj", psm=6)
+    
+    with ThreadPoolExecutor(max_workers=MAX_OCR_WORKERS) as pool:
+        page_results = []
+        for start in range(0, len(pages), OCR_BATCH_PAGES):
+            batch = pages[start:start + OCR_BATCH_PAGES]
+            batch_result = pool.submit(ocr_batch, batch)
+            page_results.extend((batch_result, position) for position in range(len(batch)))
+    
+    for page_num, (batch_result, position) in enumerate(page_results, start=1):
         print(f"   Page {page_num}/{len(pages)}...", end=" ")
         
         try:
-            # Preprocess and OCR
-            processed_page = preprocess_image(page)
-            custom_config = r'--oem 3 --psm 6 -l guj'  # Remove +eng
-            text = pytesseract.image_to_string(processed_page, config=custom_config)
+            text = batch_result.result()[position]
             
             if not text.strip():
                 print("⚠️ No text")
@@ -192,6 +239,7 @@ def ocr_pdf(pdf_path, subject, grade, language, skip_if_exists=True):
             except Exception as e:
                 print(f"   ⚠️ Error saving batch: {e}")
         
+        open_builds[db_path]["added"] += saved_count
         print(f"✅ Successfully added {saved_count} chunks from {pdf_filename}!")
         return saved_count, db_path
     else:
@@ -316,8 +364,7 @@ if __name__ == "__main__":
                 processed += 1
             else:
                 # Check if it was skipped or failed
-                temp_client = chromadb.PersistentClient(path=db_path)
-                temp_collection = temp_client.get_or_create_collection(name=COLLECTION_NAME)
+                temp_collection = get_build_collection(db_path)
                 if is_already_processed(temp_collection, os.path.basename(book["path"])):
                     skipped += 1
                 else:
@@ -327,6 +374,10 @@ if __name__ == "__main__":
             print(f"❌ Fatal error processing {book['path']}: {e}")
             failed += 1
     
+    # Validate and atomically publish the new database versions
+    print()
+    publish_builds()
+    
     # Summary
     print("\n" + "="*70)
     print("📊 PROCESSING SUMMARY")